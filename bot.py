@@ -5,8 +5,9 @@ import os
 from typing import Optional, Literal
 import asyncio
 import random
+import signal
 from datetime import datetime, timedelta
-from servants_data import SERVANTS, get_rank_color, get_rank_emoji, get_class_emoji
+from servants_data import SERVANTS, RANK_COUNTS, get_rank_color, get_rank_emoji, get_class_emoji
 import database as db
 
 # Bot setup
@@ -205,16 +206,18 @@ class ServantSelect(discord.ui.Select):
         servants = SERVANTS[self.rank]
         selected_servant = next(s for s in servants if s["name"] == self.values[0])
         
-        # Add to database and get servant ID
-        servant_id = await db.add_summon(
-            interaction.user.id,
-            interaction.guild.id,
-            selected_servant,
-            self.rank
-        )
-        
-        # Update mission progress
-        await db.update_mission_progress(interaction.user.id, interaction.guild.id, "summon", 1)
+        async with db.transaction() as conn:
+            # Add to database and get servant ID
+            servant_id = await db.add_summon(
+                interaction.user.id,
+                interaction.guild.id,
+                selected_servant,
+                self.rank,
+                conn=conn
+            )
+            
+            # Update mission progress
+            await db.update_mission_progress(interaction.user.id, interaction.guild.id, "summon", 1, conn=conn)
         
         # Create enhanced embed
         embed = discord.Embed(
@@ -551,9 +554,13 @@ class ServantBattleSelect(discord.ui.Select):
         
         await interaction.response.defer()
         
-        # Get servant stats
-        s1_stats = await db.get_servant_stats(self.challenger_servant_id)
-        s2_stats = await db.get_servant_stats(opponent_servant_id)
+        # Get servant and user stats concurrently
+        s1_stats, s2_stats, challenger_user, opponent_user = await asyncio.gather(
+            db.get_servant_stats(self.challenger_servant_id),
+            db.get_servant_stats(opponent_servant_id),
+            db.get_user_stats(self.challenger_id, interaction.guild.id),
+            db.get_user_stats(self.opponent_id, interaction.guild.id)
+        )
         
         # Simulate battle
         winner, loser, battle_log = await simulate_battle(s1_stats, s2_stats)
@@ -562,9 +569,6 @@ class ServantBattleSelect(discord.ui.Select):
         winner_id = self.challenger_id if winner['id'] == self.challenger_servant_id else self.opponent_id
         
         # Calculate rewards
-        challenger_user = await db.get_user_stats(self.challenger_id, interaction.guild.id)
-        opponent_user = await db.get_user_stats(self.opponent_id, interaction.guild.id)
-        
         elo_change = calculate_elo_change(
             challenger_user['elo_rating'] if winner_id == self.challenger_id else opponent_user['elo_rating'],
             opponent_user['elo_rating'] if winner_id == self.challenger_id else challenger_user['elo_rating']
@@ -659,6 +663,9 @@ async def on_ready():
     try:
         await db.init_db()
         print('  ✓ Database initialized')
+        await db.prime_catalog_caches()
+        await db.load_cooldowns()
+        print('  ✓ Catalog and cooldown caches primed')
     except Exception as e:
         print(f'  ✗ Database initialization failed: {e}')
         import traceback
@@ -689,6 +696,9 @@ async def on_ready():
     # 4. Start background tasks AFTER database is ready
     try:
         cleanup_cooldowns.start()
+        flush_cooldowns.start()
+        refresh_leaderboards.start()
+        pool_health_check.start()
         print('  ✓ Background tasks started')
     except Exception as e:
         print(f'  ✗ Failed to start background tasks: {e}')
@@ -711,11 +721,28 @@ async def on_ready():
     print('  Bot is ready!')
     print('━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━')
 
-@tasks.loop(minutes=5)
+@tasks.loop(seconds=30)
 async def cleanup_cooldowns():
-    """Clean up expired cooldowns every 5 minutes"""
+    """Clean up expired cooldowns every 30 seconds"""
     await db.clear_expired_cooldowns()
 
+@tasks.loop(seconds=0.2)
+async def flush_cooldowns():
+    """Write buffered cooldowns to the database in batches"""
+    await db.flush_cooldowns()
+
+@tasks.loop(seconds=60)
+async def refresh_leaderboards():
+    """Refresh leaderboard materialized views every minute"""
+    await db.refresh_leaderboards()
+
+@tasks.loop(seconds=30)
+async def pool_health_check():
+    """Verify database connectivity and report pool usage when it fails"""
+    if not await db.check_pool_health():
+        stats = db.get_pool_stats()
+        print(f'  ✗ Database health check failed (pool: {stats["size"]} open, {stats["idle"]} idle)')
+
 # ============================================================================
 # SUMMON COMMANDS
 # ============================================================================
@@ -731,8 +758,10 @@ async def summon(interaction: discord.Interaction):
         return
     
     # Check servant limit
-    max_summons = await db.get_max_summons(interaction.guild.id)
-    current_summons = await db.get_user_summons(interaction.user.id, interaction.guild.id)
+    max_summons, current_summons = await asyncio.gather(
+        db.get_max_summons(interaction.guild.id),
+        db.get_user_summons(interaction.user.id, interaction.guild.id)
+    )
     
     if len(current_summons) >= max_summons:
         await interaction.response.send_message(
@@ -800,7 +829,11 @@ async def myservants(interaction: discord.Interaction):
         )
         return
     
-    max_summons = await db.get_max_summons(interaction.guild.id)
+    shown = summons[:10]  # Show max 10
+    max_summons, servant_stats = await asyncio.gather(
+        db.get_max_summons(interaction.guild.id),
+        db.get_servants_stats([s['id'] for s in shown])
+    )
     
     embed = discord.Embed(
         title=f"📜 {interaction.user.display_name}'s Servants",
@@ -809,9 +842,8 @@ async def myservants(interaction: discord.Interaction):
         timestamp=datetime.now()
     )
     
-    for s in summons[:10]:  # Show max 10
-        stats = await db.get_servant_stats(s['id'])
-        
+    for s in shown:
+        stats = servant_stats[s['id']]
         fav_mark = "⭐ " if s['is_favorite'] else ""
         level_emoji = get_level_emoji(s['level'])
         
@@ -905,8 +937,10 @@ async def balance(interaction: discord.Interaction):
         )
         return
     
-    currency = await db.get_user_currency(interaction.user.id, interaction.guild.id)
-    stats = await db.get_user_stats(interaction.user.id, interaction.guild.id)
+    currency, stats = await asyncio.gather(
+        db.get_user_currency(interaction.user.id, interaction.guild.id),
+        db.get_user_stats(interaction.user.id, interaction.guild.id)
+    )
     
     embed = discord.Embed(
         title=f"💰 {interaction.user.display_name}'s Balance",
@@ -1037,8 +1071,9 @@ async def buy(interaction: discord.Interaction, item_name: str):
         return
     
     # Purchase item
-    await db.update_user_currency(interaction.user.id, interaction.guild.id, -item['price'], 0)
-    await db.add_item_to_inventory(interaction.user.id, interaction.guild.id, item['id'], 1)
+    async with db.transaction() as conn:
+        await db.update_user_currency(interaction.user.id, interaction.guild.id, -item['price'], 0, conn=conn)
+        await db.add_item_to_inventory(interaction.user.id, interaction.guild.id, item['id'], 1, conn=conn)
     
     embed = discord.Embed(
         title="✅ Purchase Successful!",
@@ -1156,10 +1191,11 @@ async def equip(interaction: discord.Interaction, servant_id: int, item_name: st
     
     # Equip item
     slot_type = item['item_type']
-    await db.equip_item(servant_id, item['id'], slot_type)
-    
-    # Update mission progress
-    await db.update_mission_progress(interaction.user.id, interaction.guild.id, "use_item", 1)
+    async with db.transaction() as conn:
+        await db.equip_item(servant_id, item['id'], slot_type, conn=conn)
+        
+        # Update mission progress
+        await db.update_mission_progress(interaction.user.id, interaction.guild.id, "use_item", 1, conn=conn)
     
     embed = discord.Embed(
         title="✅ Item Equipped!",
@@ -1269,11 +1305,7 @@ async def missions(interaction: discord.Interaction):
         )
         return
     
-    all_missions = await db.get_daily_missions()
-    user_progress = await db.get_user_mission_progress(interaction.user.id, interaction.guild.id)
-    
-    # Create progress map
-    progress_map = {p['mission_id']: p for p in user_progress}
+    user_missions = await db.get_user_mission_progress(interaction.user.id, interaction.guild.id)
     
     embed = discord.Embed(
         title="📋 Daily Missions",
@@ -1282,17 +1314,10 @@ async def missions(interaction: discord.Interaction):
         timestamp=datetime.now()
     )
     
-    for mission in all_missions:
-        progress = progress_map.get(mission['id'])
-        
-        if progress:
-            current = progress['progress']
-            completed = progress['completed']
-            claimed = progress['claimed']
-        else:
-            current = 0
-            completed = False
-            claimed = False
+    for mission in user_missions:
+        current = mission['progress']
+        completed = mission['completed']
+        claimed = mission['claimed']
         
         # Status emoji
         if claimed:
@@ -1746,10 +1771,10 @@ async def servantlist(interaction: discord.Interaction, rank: Literal["EX", "S",
             inline=False
         )
     
-    if len(servants) > 15:
-        embed.set_footer(text=f"Showing 15 of {len(servants)} servants")
+    if RANK_COUNTS[rank] > 15:
+        embed.set_footer(text=f"Showing 15 of {RANK_COUNTS[rank]} servants")
     else:
-        embed.set_footer(text=f"Total: {len(servants)} servants")
+        embed.set_footer(text=f"Total: {RANK_COUNTS[rank]} servants")
     
     await interaction.response.send_message(embed=embed)
 
@@ -1757,8 +1782,11 @@ async def servantlist(interaction: discord.Interaction, rank: Literal["EX", "S",
 async def stats(interaction: discord.Interaction):
     """Stats command"""
     # Get guild stats
-    elo_leaders = await db.get_elo_leaderboard(interaction.guild.id, 1)
-    servant_leaders = await db.get_servant_leaderboard(interaction.guild.id, 1)
+    elo_leaders, servant_leaders, max_summons = await asyncio.gather(
+        db.get_elo_leaderboard(interaction.guild.id, 1),
+        db.get_servant_leaderboard(interaction.guild.id, 1),
+        db.get_max_summons(interaction.guild.id)
+    )
     
     embed = discord.Embed(
         title="📊 Holy Grail War Statistics",
@@ -1783,7 +1811,6 @@ async def stats(interaction: discord.Interaction):
             inline=True
         )
     
-    max_summons = await db.get_max_summons(interaction.guild.id)
     embed.add_field(
         name="📈 Max Summons",
         value=f"**{max_summons}** per user",
@@ -1890,7 +1917,26 @@ async def main():
     if not token:
         raise ValueError("DISCORD_TOKEN environment variable not set")
     
-    await bot.start(token)
+    # Treat SIGTERM (container stop) like Ctrl+C so the shutdown below still runs
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass
+    
+    try:
+        await bot.start(token)
+    finally:
+        # Stop background tasks, then flush buffered cooldowns and close the pool
+        for task in (cleanup_cooldowns, flush_cooldowns, refresh_leaderboards, pool_health_check):
+            task.cancel()
+        if not bot.is_closed():
+            await bot.close()
+        await db.close_db()
+        print('  ✓ Database connections closed')
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        asyncio.run(main())
+    except asyncio.CancelledError:
+        # Raised by the SIGTERM handler after the shutdown has completed
+        pass
\ No newline at end of file
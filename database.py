@@ -3,342 +3,654 @@ Database module for Fate Bot
 Handles all database operations with Neon PostgreSQL
 """
 
+import asyncio
 import asyncpg
+import heapq
 import os
+import time
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple, TypedDict
 import random
+from contextlib import asynccontextmanager
 
 # Global database pool
 db_pool = None
 
+# Pool tuning; the statement cache is sized above the number of distinct SQL strings in this module
+POOL_MIN_SIZE = 10
+POOL_MAX_SIZE = 50
+STATEMENT_CACHE_SIZE = 256
+COMMAND_TIMEOUT = 10
+
+# Index builds and materialized view refreshes may legitimately outlast COMMAND_TIMEOUT
+MAINTENANCE_TIMEOUT = 600
+
+# Bump whenever the DDL in _create_schema changes
+CURRENT_SCHEMA_VERSION = 7
+
+# Dedicated connection listening for guild setting changes from other workers
+_listener_conn = None
+
+# In-process cache of guild settings: guild_id -> (cached_at, settings)
+GUILD_CACHE_TTL = 60
+_guild_cache: Dict[int, Tuple[float, Dict[str, Any]]] = {}
+
+# In-process cache of the static items/daily_missions catalogs, filled by
+# prime_catalog_caches() and reloaded lazily after invalidate_catalog_caches()
+_catalog_primed = False
+_items_by_id: Dict[int, asyncpg.Record] = {}
+_items_by_name: Dict[str, asyncpg.Record] = {}
+_all_items: Tuple[asyncpg.Record, ...] = ()
+_missions_by_type: Dict[str, asyncpg.Record] = {}
+_all_missions: Tuple[asyncpg.Record, ...] = ()
+
+# Active cooldowns, served entirely from memory: (user, guild, action) -> expires_at
+_cooldowns: Dict[Tuple[int, int, str], datetime] = {}
+
+# Min-heap of (expires_at, key) so expired cooldowns are pruned without a full scan
+_cooldown_expiries: List[Tuple[datetime, Tuple[int, int, str]]] = []
+
+# Write-behind buffer of cooldown upserts, drained by flush_cooldowns()
+_pending_cooldowns: Dict[Tuple[int, int, str], datetime] = {}
+
+# Leaderboard pages served from memory within a 30 second epoch:
+# (board, guild_id, limit) -> (epoch, rows)
+LEADERBOARD_CACHE_TTL = 30
+_leaderboard_cache: Dict[Tuple[str, int, int], Tuple[int, List[asyncpg.Record]]] = {}
+
+class LevelResult(TypedDict):
+    """Result of adding experience to a servant"""
+    level: int
+    exp: int
+    levels_gained: int
+    exp_needed: int
+
+# Functional form because "class" is a reserved word
+ServantStats = TypedDict('ServantStats', {
+    "id": int,
+    "name": str,
+    "class": str,
+    "rank": str,
+    "level": int,
+    "attack": int,
+    "defense": int,
+    "hp": int,
+    "speed": int,
+    "wins": int,
+    "total_battles": int
+})
+
+# ============================================================================
+# CONNECTION HELPERS
+# ============================================================================
+
+# Every hot-path SQL string; init_db prepares them all at startup to validate them.
+# At runtime they go through asyncpg's per-connection statement cache, which
+# prepares each string once per physical connection and survives pool release
+_PREPARED_SQL: List[str] = []
+
+def _hot_sql(sql: str) -> str:
+    """Register a hot-path statement so init_db validates it by preparing it"""
+    _PREPARED_SQL.append(sql)
+    return sql
+
+@asynccontextmanager
+async def _acquire(conn=None):
+    """Reuse the caller's connection if given, otherwise acquire one from the pool"""
+    if conn is not None:
+        yield conn
+    else:
+        async with db_pool.acquire() as pooled:
+            yield pooled
+
+@asynccontextmanager
+async def transaction():
+    """Hold one pooled connection for a multi-step unit of work, atomically"""
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            yield conn
+
+async def check_pool_health() -> bool:
+    """Round-trip a trivial query to verify the pool can reach the database"""
+    try:
+        async with db_pool.acquire() as conn:
+            return await conn.fetchval('SELECT 1', timeout=5) == 1
+    except Exception:
+        return False
+
+def get_pool_stats() -> Dict[str, int]:
+    """Current pool size and idle connection count, for tuning min/max sizes"""
+    return {
+        "size": db_pool.get_size(),
+        "idle": db_pool.get_idle_size(),
+        "min_size": db_pool.get_min_size(),
+        "max_size": db_pool.get_max_size()
+    }
+
 # ============================================================================
 # INITIALIZATION
 # ============================================================================
 
 async def init_db():
     """Initialize database connection pool and create all tables"""
-    global db_pool
+    global db_pool, _listener_conn
     
     database_url = os.getenv('DATABASE_URL')
     if not database_url:
         raise ValueError("DATABASE_URL environment variable not set")
     
     # Create connection pool
-    db_pool = await asyncpg.create_pool(database_url, min_size=5, max_size=20)
+    db_pool = await asyncpg.create_pool(
+        database_url,
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+        max_queries=50000,
+        max_inactive_connection_lifetime=300,
+        statement_cache_size=STATEMENT_CACHE_SIZE,
+        command_timeout=COMMAND_TIMEOUT
+    )
+    
+    # Invalidate cached guild settings when another worker changes them
+    _listener_conn = await asyncpg.connect(database_url)
+    await _listener_conn.add_listener('guilds_changed', _on_guilds_changed)
     
     async with db_pool.acquire() as conn:
-        # ====================================================================
-        # CORE TABLES
-        # ====================================================================
-        
-        # Guilds table
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS guilds (
-                guild_id BIGINT PRIMARY KEY,
-                max_summons INTEGER DEFAULT 1,
-                registration_role_id BIGINT,
-                registration_channel_id BIGINT,
-                registration_message_id BIGINT,
-                battle_forum_id BIGINT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Users table (enhanced with economy and stats)
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT,
-                guild_id BIGINT,
-                is_registered BOOLEAN DEFAULT FALSE,
-                registered_at TIMESTAMP,
-                saint_quartz INTEGER DEFAULT 100,
-                summon_tickets INTEGER DEFAULT 3,
-                last_daily_claim TIMESTAMP,
-                battle_wins INTEGER DEFAULT 0,
-                battle_losses INTEGER DEFAULT 0,
-                elo_rating INTEGER DEFAULT 1000,
-                total_summons INTEGER DEFAULT 0,
-                current_streak INTEGER DEFAULT 0,
-                longest_streak INTEGER DEFAULT 0,
-                PRIMARY KEY (user_id, guild_id),
-                FOREIGN KEY (guild_id) REFERENCES guilds(guild_id) ON DELETE CASCADE
-            )
-        ''')
-        
-        # Summons/Servants table (enhanced with stats and leveling)
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS summons (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT,
-                guild_id BIGINT,
-                servant_name TEXT NOT NULL,
-                servant_class TEXT NOT NULL,
-                servant_rank TEXT NOT NULL,
-                description TEXT,
-                noble_phantasm TEXT,
-                image_url TEXT,
-                level INTEGER DEFAULT 1,
-                experience INTEGER DEFAULT 0,
-                base_attack INTEGER DEFAULT 100,
-                base_defense INTEGER DEFAULT 100,
-                base_hp INTEGER DEFAULT 1000,
-                base_speed INTEGER DEFAULT 50,
-                bonus_attack INTEGER DEFAULT 0,
-                bonus_defense INTEGER DEFAULT 0,
-                bonus_hp INTEGER DEFAULT 0,
-                bonus_speed INTEGER DEFAULT 0,
-                is_favorite BOOLEAN DEFAULT FALSE,
-                total_battles INTEGER DEFAULT 0,
-                battles_won INTEGER DEFAULT 0,
-                summoned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_battle TIMESTAMP,
-                FOREIGN KEY (user_id, guild_id) REFERENCES users(user_id, guild_id) ON DELETE CASCADE
-            )
-        ''')
-        
-        # ====================================================================
-        # EQUIPMENT & ITEMS TABLES
-        # ====================================================================
-        
-        # Items table
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS items (
-                id SERIAL PRIMARY KEY,
-                name TEXT NOT NULL UNIQUE,
-                description TEXT,
-                item_type TEXT NOT NULL,
-                rarity TEXT NOT NULL,
-                stat_type TEXT,
-                stat_value INTEGER,
-                price INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # User inventory
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS inventory (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT,
-                guild_id BIGINT,
-                item_id INTEGER,
-                quantity INTEGER DEFAULT 1,
-                acquired_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id, guild_id) REFERENCES users(user_id, guild_id) ON DELETE CASCADE,
-                FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE,
-                UNIQUE(user_id, guild_id, item_id)
-            )
-        ''')
-        
-        # Equipped items (Command Seals/Equipment)
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS equipped_items (
-                id SERIAL PRIMARY KEY,
-                servant_id INTEGER,
-                item_id INTEGER,
-                slot_type TEXT NOT NULL,
-                equipped_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (servant_id) REFERENCES summons(id) ON DELETE CASCADE,
-                FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE
-            )
-        ''')
-        
-        # ====================================================================
-        # BATTLE SYSTEM TABLES
-        # ====================================================================
-        
-        # Battles table
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS battles (
-                id SERIAL PRIMARY KEY,
-                guild_id BIGINT,
-                challenger_id BIGINT,
-                opponent_id BIGINT,
-                challenger_servant_id INTEGER,
-                opponent_servant_id INTEGER,
-                winner_id BIGINT,
-                battle_log TEXT,
-                elo_change INTEGER,
-                experience_gained INTEGER,
-                forum_thread_id BIGINT,
-                battle_type TEXT DEFAULT 'ranked',
-                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                completed_at TIMESTAMP,
-                FOREIGN KEY (guild_id) REFERENCES guilds(guild_id) ON DELETE CASCADE,
-                FOREIGN KEY (challenger_servant_id) REFERENCES summons(id) ON DELETE SET NULL,
-                FOREIGN KEY (opponent_servant_id) REFERENCES summons(id) ON DELETE SET NULL
-            )
-        ''')
-        
-        # ====================================================================
-        # EVENTS & MISSIONS TABLES
-        # ====================================================================
-        
-        # Daily missions
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS daily_missions (
-                id SERIAL PRIMARY KEY,
-                mission_type TEXT NOT NULL,
-                description TEXT NOT NULL,
-                requirement INTEGER NOT NULL,
-                sq_reward INTEGER DEFAULT 10,
-                ticket_reward INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # User mission progress
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS user_mission_progress (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT,
-                guild_id BIGINT,
-                mission_id INTEGER,
-                progress INTEGER DEFAULT 0,
-                completed BOOLEAN DEFAULT FALSE,
-                claimed BOOLEAN DEFAULT FALSE,
-                reset_date DATE DEFAULT CURRENT_DATE,
-                FOREIGN KEY (user_id, guild_id) REFERENCES users(user_id, guild_id) ON DELETE CASCADE,
-                FOREIGN KEY (mission_id) REFERENCES daily_missions(id) ON DELETE CASCADE,
-                UNIQUE(user_id, guild_id, mission_id, reset_date)
-            )
-        ''')
-        
-        # Holy Grail War events
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS holy_grail_wars (
-                id SERIAL PRIMARY KEY,
-                guild_id BIGINT,
-                name TEXT NOT NULL,
-                description TEXT,
-                start_time TIMESTAMP NOT NULL,
-                end_time TIMESTAMP NOT NULL,
-                prize_pool_sq INTEGER DEFAULT 1000,
-                max_participants INTEGER DEFAULT 16,
-                status TEXT DEFAULT 'upcoming',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (guild_id) REFERENCES guilds(guild_id) ON DELETE CASCADE
-            )
-        ''')
-        
-        # War participants
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS war_participants (
-                id SERIAL PRIMARY KEY,
-                war_id INTEGER,
-                user_id BIGINT,
-                guild_id BIGINT,
-                servant_id INTEGER,
-                placement INTEGER,
-                eliminated_at TIMESTAMP,
-                FOREIGN KEY (war_id) REFERENCES holy_grail_wars(id) ON DELETE CASCADE,
-                FOREIGN KEY (user_id, guild_id) REFERENCES users(user_id, guild_id) ON DELETE CASCADE,
-                FOREIGN KEY (servant_id) REFERENCES summons(id) ON DELETE SET NULL,
-                UNIQUE(war_id, user_id, guild_id)
-            )
-        ''')
-        
-        # ====================================================================
-        # COOLDOWNS TABLE
-        # ====================================================================
-        
-        # Cooldowns
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS cooldowns (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT,
-                guild_id BIGINT,
-                action_type TEXT NOT NULL,
-                expires_at TIMESTAMP NOT NULL,
-                FOREIGN KEY (user_id, guild_id) REFERENCES users(user_id, guild_id) ON DELETE CASCADE,
-                UNIQUE(user_id, guild_id, action_type)
-            )
-        ''')
-        
-        # ====================================================================
-        # ADMIN LOGS TABLE
-        # ====================================================================
-        
-        # Admin action logs
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS admin_logs (
-                id SERIAL PRIMARY KEY,
-                guild_id BIGINT,
-                admin_id BIGINT,
-                action_type TEXT NOT NULL,
-                target_user_id BIGINT,
-                details TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (guild_id) REFERENCES guilds(guild_id) ON DELETE CASCADE
-            )
-        ''')
-        
-        # ====================================================================
-        # INDEXES for performance
-        # ====================================================================
-        
-        # MIGRATION: Check if columns exist before creating indexes
-        # This handles cases where the database was created with an older schema
-        
-        # Check if 'level' column exists in summons table
-        level_exists = await conn.fetchval('''
-            SELECT EXISTS (
-                SELECT 1 FROM information_schema.columns 
-                WHERE table_name = 'summons' AND column_name = 'level'
-            )
-        ''')
-        
-        if not level_exists:
-            print('  Migrating summons table: Adding new columns...')
-            # Add all missing columns from the new schema
-            await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS level INTEGER DEFAULT 1')
-            await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS experience INTEGER DEFAULT 0')
-            await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS base_attack INTEGER DEFAULT 100')
-            await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS base_defense INTEGER DEFAULT 100')
-            await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS base_hp INTEGER DEFAULT 1000')
-            await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS base_speed INTEGER DEFAULT 50')
-            await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS bonus_attack INTEGER DEFAULT 0')
-            await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS bonus_defense INTEGER DEFAULT 0')
-            await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS bonus_hp INTEGER DEFAULT 0')
-            await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS bonus_speed INTEGER DEFAULT 0')
-            await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS is_favorite BOOLEAN DEFAULT FALSE')
-            await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS total_battles INTEGER DEFAULT 0')
-            await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS battles_won INTEGER DEFAULT 0')
-            await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS last_battle TIMESTAMP')
-            print('  ✓ Summons table migrated successfully')
-        
-        # Check if users table has economy columns
-        quartz_exists = await conn.fetchval('''
-            SELECT EXISTS (
-                SELECT 1 FROM information_schema.columns 
-                WHERE table_name = 'users' AND column_name = 'saint_quartz'
-            )
-        ''')
-        
-        if not quartz_exists:
-            print('  Migrating users table: Adding economy columns...')
-            await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS saint_quartz INTEGER DEFAULT 100')
-            await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS summon_tickets INTEGER DEFAULT 3')
-            await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS last_daily_claim TIMESTAMP')
-            await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS battle_wins INTEGER DEFAULT 0')
-            await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS battle_losses INTEGER DEFAULT 0')
-            await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS elo_rating INTEGER DEFAULT 1000')
-            await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS total_summons INTEGER DEFAULT 0')
-            await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS current_streak INTEGER DEFAULT 0')
-            await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS longest_streak INTEGER DEFAULT 0')
-            print('  ✓ Users table migrated successfully')
+        # Skip the DDL batch when the schema is already current
+        try:
+            schema_version = await conn.fetchval('SELECT v FROM schema_version')
+        except asyncpg.exceptions.UndefinedTableError:
+            schema_version = None
         
-        # Now create indexes (safe to do now that columns exist)
-        await conn.execute('CREATE INDEX IF NOT EXISTS idx_summons_user_guild ON summons(user_id, guild_id)')
-        await conn.execute('CREATE INDEX IF NOT EXISTS idx_summons_level ON summons(level DESC)')
-        await conn.execute('CREATE INDEX IF NOT EXISTS idx_battles_guild ON battles(guild_id)')
-        await conn.execute('CREATE INDEX IF NOT EXISTS idx_users_elo ON users(elo_rating DESC)')
-        await conn.execute('CREATE INDEX IF NOT EXISTS idx_cooldowns_expires ON cooldowns(expires_at)')
+        if schema_version != CURRENT_SCHEMA_VERSION:
+            await _create_schema(conn)
+            await conn.execute('''
+                INSERT INTO schema_version (id, v) VALUES (TRUE, $1)
+                ON CONFLICT (id) DO UPDATE SET v = EXCLUDED.v
+            ''', CURRENT_SCHEMA_VERSION)
         
         # Initialize default items if not exist
         await initialize_default_items(conn)
         await initialize_default_missions(conn)
+        
+        # Prepare every hot-path statement once, so a statement Postgres rejects
+        # (e.g. ambiguous parameter types) fails startup instead of a command
+        for sql in _PREPARED_SQL:
+            await conn.prepare(sql)
+
+async def _create_schema(conn):
+    """Create all tables and indexes, migrating older schemas in place"""
+    # ====================================================================
+    # CORE TABLES
+    # ====================================================================
+    
+    # Guilds table
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS guilds (
+            guild_id BIGINT PRIMARY KEY,
+            max_summons INTEGER DEFAULT 1,
+            registration_role_id BIGINT,
+            registration_channel_id BIGINT,
+            registration_message_id BIGINT,
+            battle_forum_id BIGINT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Users table (enhanced with economy and stats)
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT,
+            guild_id BIGINT,
+            is_registered BOOLEAN DEFAULT FALSE,
+            registered_at TIMESTAMP,
+            saint_quartz INTEGER DEFAULT 100,
+            summon_tickets INTEGER DEFAULT 3,
+            last_daily_claim TIMESTAMP,
+            battle_wins INTEGER DEFAULT 0,
+            battle_losses INTEGER DEFAULT 0,
+            elo_rating INTEGER DEFAULT 1000,
+            total_summons INTEGER DEFAULT 0,
+            current_streak INTEGER DEFAULT 0,
+            longest_streak INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, guild_id),
+            FOREIGN KEY (guild_id) REFERENCES guilds(guild_id) ON DELETE CASCADE
+        )
+    ''')
+    
+    # Summons/Servants table (enhanced with stats and leveling)
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS summons (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT,
+            guild_id BIGINT,
+            servant_name TEXT NOT NULL,
+            servant_class TEXT NOT NULL,
+            servant_rank TEXT NOT NULL,
+            description TEXT,
+            noble_phantasm TEXT,
+            image_url TEXT,
+            level INTEGER DEFAULT 1,
+            experience INTEGER DEFAULT 0,
+            base_attack INTEGER DEFAULT 100,
+            base_defense INTEGER DEFAULT 100,
+            base_hp INTEGER DEFAULT 1000,
+            base_speed INTEGER DEFAULT 50,
+            bonus_attack INTEGER DEFAULT 0,
+            bonus_defense INTEGER DEFAULT 0,
+            bonus_hp INTEGER DEFAULT 0,
+            bonus_speed INTEGER DEFAULT 0,
+            is_favorite BOOLEAN DEFAULT FALSE,
+            total_battles INTEGER DEFAULT 0,
+            battles_won INTEGER DEFAULT 0,
+            summoned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_battle TIMESTAMP,
+            FOREIGN KEY (user_id, guild_id) REFERENCES users(user_id, guild_id) ON DELETE CASCADE
+        )
+    ''')
+    
+    # ====================================================================
+    # EQUIPMENT & ITEMS TABLES
+    # ====================================================================
+    
+    # Items table
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS items (
+            id SMALLSERIAL PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            description TEXT,
+            item_type TEXT NOT NULL,
+            rarity TEXT NOT NULL,
+            stat_type TEXT,
+            stat_value INTEGER,
+            price INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # User inventory
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS inventory (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            guild_id BIGINT,
+            item_id SMALLINT,
+            quantity INTEGER DEFAULT 1,
+            acquired_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id, guild_id) REFERENCES users(user_id, guild_id) ON DELETE CASCADE,
+            FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE,
+            UNIQUE(user_id, guild_id, item_id)
+        )
+    ''')
+    
+    # Equipped items (Command Seals/Equipment)
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS equipped_items (
+            id SERIAL PRIMARY KEY,
+            servant_id BIGINT,
+            item_id SMALLINT,
+            slot_type TEXT NOT NULL,
+            equipped_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (servant_id) REFERENCES summons(id) ON DELETE CASCADE,
+            FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE
+        )
+    ''')
+    
+    # ====================================================================
+    # BATTLE SYSTEM TABLES
+    # ====================================================================
+    
+    # Battles table
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS battles (
+            id SERIAL PRIMARY KEY,
+            guild_id BIGINT,
+            challenger_id BIGINT,
+            opponent_id BIGINT,
+            challenger_servant_id BIGINT,
+            opponent_servant_id BIGINT,
+            winner_id BIGINT,
+            elo_change INTEGER,
+            experience_gained INTEGER,
+            forum_thread_id BIGINT,
+            battle_type TEXT DEFAULT 'ranked',
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP,
+            FOREIGN KEY (guild_id) REFERENCES guilds(guild_id) ON DELETE CASCADE,
+            FOREIGN KEY (challenger_servant_id) REFERENCES summons(id) ON DELETE SET NULL,
+            FOREIGN KEY (opponent_servant_id) REFERENCES summons(id) ON DELETE SET NULL
+        )
+    ''')
+    
+    # Battle logs (kept out of the battles row so scans of battles stay narrow)
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS battle_logs (
+            battle_id INTEGER PRIMARY KEY,
+            log TEXT NOT NULL,
+            FOREIGN KEY (battle_id) REFERENCES battles(id) ON DELETE CASCADE
+        )
+    ''')
+    
+    # ====================================================================
+    # EVENTS & MISSIONS TABLES
+    # ====================================================================
+    
+    # Daily missions
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_missions (
+            id SMALLSERIAL PRIMARY KEY,
+            mission_type TEXT NOT NULL UNIQUE,
+            description TEXT NOT NULL,
+            requirement INTEGER NOT NULL,
+            sq_reward INTEGER DEFAULT 10,
+            ticket_reward INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # User mission progress
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_mission_progress (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            guild_id BIGINT,
+            mission_id SMALLINT,
+            progress INTEGER DEFAULT 0,
+            completed BOOLEAN DEFAULT FALSE,
+            claimed BOOLEAN DEFAULT FALSE,
+            reset_date DATE DEFAULT CURRENT_DATE,
+            FOREIGN KEY (user_id, guild_id) REFERENCES users(user_id, guild_id) ON DELETE CASCADE,
+            FOREIGN KEY (mission_id) REFERENCES daily_missions(id) ON DELETE CASCADE,
+            UNIQUE(user_id, guild_id, mission_id, reset_date)
+        )
+    ''')
+    
+    # Holy Grail War events
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS holy_grail_wars (
+            id SERIAL PRIMARY KEY,
+            guild_id BIGINT,
+            name TEXT NOT NULL,
+            description TEXT,
+            start_time TIMESTAMP NOT NULL,
+            end_time TIMESTAMP NOT NULL,
+            prize_pool_sq INTEGER DEFAULT 1000,
+            max_participants INTEGER DEFAULT 16,
+            status TEXT DEFAULT 'upcoming',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (guild_id) REFERENCES guilds(guild_id) ON DELETE CASCADE
+        )
+    ''')
+    
+    # War participants
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS war_participants (
+            id SERIAL PRIMARY KEY,
+            war_id INTEGER,
+            user_id BIGINT,
+            guild_id BIGINT,
+            servant_id BIGINT,
+            placement INTEGER,
+            eliminated_at TIMESTAMP,
+            FOREIGN KEY (war_id) REFERENCES holy_grail_wars(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id, guild_id) REFERENCES users(user_id, guild_id) ON DELETE CASCADE,
+            FOREIGN KEY (servant_id) REFERENCES summons(id) ON DELETE SET NULL,
+            UNIQUE(war_id, user_id, guild_id)
+        )
+    ''')
+    
+    # ====================================================================
+    # COOLDOWNS TABLE
+    # ====================================================================
+    
+    # Cooldowns
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS cooldowns (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            guild_id BIGINT,
+            action_type TEXT NOT NULL,
+            expires_at TIMESTAMP NOT NULL,
+            FOREIGN KEY (user_id, guild_id) REFERENCES users(user_id, guild_id) ON DELETE CASCADE,
+            UNIQUE(user_id, guild_id, action_type)
+        )
+    ''')
+    
+    # ====================================================================
+    # ADMIN LOGS TABLE
+    # ====================================================================
+    
+    # Admin action logs (kept logged: an unlogged table is truncated after every
+    # unclean shutdown, which on Neon includes compute restarts)
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS admin_logs (
+            id SERIAL PRIMARY KEY,
+            guild_id BIGINT,
+            admin_id BIGINT,
+            action_type TEXT NOT NULL,
+            target_user_id BIGINT,
+            details TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (guild_id) REFERENCES guilds(guild_id) ON DELETE CASCADE
+        )
+    ''')
+    
+    # ====================================================================
+    # INDEXES for performance
+    # ====================================================================
+    
+    # MIGRATION: Check if columns exist before creating indexes
+    # This handles cases where the database was created with an older schema
+    
+    # Check if 'level' column exists in summons table
+    level_exists = await conn.fetchval('''
+        SELECT EXISTS (
+            SELECT 1 FROM information_schema.columns 
+            WHERE table_name = 'summons' AND column_name = 'level'
+        )
+    ''')
+    
+    if not level_exists:
+        print('  Migrating summons table: Adding new columns...')
+        # Add all missing columns from the new schema
+        await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS level INTEGER DEFAULT 1')
+        await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS experience INTEGER DEFAULT 0')
+        await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS base_attack INTEGER DEFAULT 100')
+        await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS base_defense INTEGER DEFAULT 100')
+        await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS base_hp INTEGER DEFAULT 1000')
+        await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS base_speed INTEGER DEFAULT 50')
+        await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS bonus_attack INTEGER DEFAULT 0')
+        await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS bonus_defense INTEGER DEFAULT 0')
+        await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS bonus_hp INTEGER DEFAULT 0')
+        await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS bonus_speed INTEGER DEFAULT 0')
+        await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS is_favorite BOOLEAN DEFAULT FALSE')
+        await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS total_battles INTEGER DEFAULT 0')
+        await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS battles_won INTEGER DEFAULT 0')
+        await conn.execute('ALTER TABLE summons ADD COLUMN IF NOT EXISTS last_battle TIMESTAMP')
+        print('  ✓ Summons table migrated successfully')
+    
+    # Check if users table has economy columns
+    quartz_exists = await conn.fetchval('''
+        SELECT EXISTS (
+            SELECT 1 FROM information_schema.columns 
+            WHERE table_name = 'users' AND column_name = 'saint_quartz'
+        )
+    ''')
+    
+    if not quartz_exists:
+        print('  Migrating users table: Adding economy columns...')
+        await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS saint_quartz INTEGER DEFAULT 100')
+        await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS summon_tickets INTEGER DEFAULT 3')
+        await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS last_daily_claim TIMESTAMP')
+        await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS battle_wins INTEGER DEFAULT 0')
+        await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS battle_losses INTEGER DEFAULT 0')
+        await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS elo_rating INTEGER DEFAULT 1000')
+        await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS total_summons INTEGER DEFAULT 0')
+        await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS current_streak INTEGER DEFAULT 0')
+        await conn.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS longest_streak INTEGER DEFAULT 0')
+        print('  ✓ Users table migrated successfully')
+    
+    # Check if battles still carries the inline battle_log column
+    inline_log_exists = await conn.fetchval('''
+        SELECT EXISTS (
+            SELECT 1 FROM information_schema.columns 
+            WHERE table_name = 'battles' AND column_name = 'battle_log'
+        )
+    ''')
+    
+    if inline_log_exists:
+        print('  Migrating battles table: Moving battle logs to battle_logs...')
+        await conn.execute('''
+            INSERT INTO battle_logs (battle_id, log)
+            SELECT id, battle_log FROM battles WHERE battle_log IS NOT NULL
+            ON CONFLICT (battle_id) DO NOTHING
+        ''', timeout=MAINTENANCE_TIMEOUT)
+        await conn.execute('ALTER TABLE battles DROP COLUMN battle_log', timeout=MAINTENANCE_TIMEOUT)
+        print('  ✓ Battles table migrated successfully')
+    
+    # Check if daily_missions is missing its UNIQUE(mission_type) key; without it
+    # the default missions were seeded again on every boot
+    mission_type_unique = await conn.fetchval(
+        "SELECT to_regclass('daily_missions_mission_type_key') IS NOT NULL"
+    )
+    
+    if not mission_type_unique:
+        print('  Migrating daily_missions table: Removing duplicate missions...')
+        async with conn.transaction():
+            # Keep the lowest id per mission_type. Of each user's progress rows for
+            # one day across the copies, keep the furthest one and point it at
+            # the kept mission
+            await conn.execute('''
+                WITH kept AS (
+                    SELECT id, MIN(id) OVER (PARTITION BY mission_type) AS keep_id
+                    FROM daily_missions
+                ), ranked AS (
+                    SELECT ump.id, ROW_NUMBER() OVER (
+                        PARTITION BY ump.user_id, ump.guild_id, kept.keep_id, ump.reset_date
+                        ORDER BY ump.claimed DESC, ump.progress DESC, ump.mission_id
+                    ) AS rn
+                    FROM user_mission_progress ump
+                    JOIN kept ON kept.id = ump.mission_id
+                )
+                DELETE FROM user_mission_progress
+                WHERE id IN (SELECT id FROM ranked WHERE rn > 1)
+            ''', timeout=MAINTENANCE_TIMEOUT)
+            await conn.execute('''
+                UPDATE user_mission_progress ump SET mission_id = kept.keep_id
+                FROM (
+                    SELECT id, MIN(id) OVER (PARTITION BY mission_type) AS keep_id
+                    FROM daily_missions
+                ) kept
+                WHERE ump.mission_id = kept.id AND kept.id <> kept.keep_id
+            ''', timeout=MAINTENANCE_TIMEOUT)
+            await conn.execute('''
+                DELETE FROM daily_missions dm
+                USING daily_missions kept
+                WHERE kept.mission_type = dm.mission_type AND kept.id < dm.id
+            ''', timeout=MAINTENANCE_TIMEOUT)
+            await conn.execute('''
+                ALTER TABLE daily_missions
+                ADD CONSTRAINT daily_missions_mission_type_key UNIQUE (mission_type)
+            ''')
+        print('  ✓ Daily missions table migrated successfully')
+    
+    # Now create indexes (safe to do now that columns exist). Concurrent builds on
+    # the same table deadlock each other, so each table's indexes are built in
+    # sequence and only different tables are built in parallel
+    await asyncio.gather(
+        _create_table_indexes(
+            ('idx_summons_user_guild', 'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_summons_user_guild ON summons(user_id, guild_id)'),
+            ('idx_summons_level', 'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_summons_level ON summons(level DESC)'),
+        ),
+        _create_table_indexes(
+            ('idx_battles_guild', 'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_battles_guild ON battles(guild_id)'),
+            ('idx_battles_challenger_completed', '''
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_battles_challenger_completed
+                ON battles(guild_id, challenger_id, completed_at DESC) WHERE completed_at IS NOT NULL
+            '''),
+            ('idx_battles_opponent_completed', '''
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_battles_opponent_completed
+                ON battles(guild_id, opponent_id, completed_at DESC) WHERE completed_at IS NOT NULL
+            '''),
+        ),
+        _create_table_indexes(
+            ('idx_users_elo', 'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_elo ON users(elo_rating DESC)'),
+        ),
+        _create_table_indexes(
+            ('idx_inventory_user_guild', '''
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_inventory_user_guild
+                ON inventory(user_id, guild_id) INCLUDE (item_id, quantity, acquired_at)
+            '''),
+        ),
+        _create_table_indexes(
+            ('idx_equipped_items_servant', 'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_equipped_items_servant ON equipped_items(servant_id)'),
+        ),
+        _create_table_indexes(
+            ('idx_mission_progress_user_date', '''
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_mission_progress_user_date
+                ON user_mission_progress(user_id, guild_id, reset_date)
+            '''),
+        ),
+    )
+    
+    # Refresh planner statistics so the new indexes are picked up immediately
+    await conn.execute('ANALYZE inventory, equipped_items, battles, user_mission_progress', timeout=MAINTENANCE_TIMEOUT)
+    
+    # Cooldown lookups use the UNIQUE(user_id, guild_id, action_type) index and
+    # expired rows are only purged at startup, so an index on expires_at only
+    # blocks HOT updates when set_cooldown rewrites the expiry
+    await conn.execute('DROP INDEX IF EXISTS idx_cooldowns_expires')
+    
+    # Every flush rewrites rows in place; vacuum early so dead versions don't bloat the heap
+    await conn.execute('ALTER TABLE cooldowns SET (autovacuum_vacuum_scale_factor = 0.02)')
+    
+    # ====================================================================
+    # LEADERBOARD MATERIALIZED VIEWS
+    # ====================================================================
+    
+    # Pre-sorted leaderboards, refreshed periodically by refresh_leaderboards()
+    await conn.execute('''
+        CREATE MATERIALIZED VIEW IF NOT EXISTS mv_elo_leaderboard AS
+        SELECT guild_id, user_id, elo_rating, battle_wins, battle_losses
+        FROM users
+        WHERE is_registered = TRUE
+    ''', timeout=MAINTENANCE_TIMEOUT)
+    await conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_elo_guild_user ON mv_elo_leaderboard(guild_id, user_id)', timeout=MAINTENANCE_TIMEOUT)
+    await conn.execute('CREATE INDEX IF NOT EXISTS idx_mv_elo_guild_rating ON mv_elo_leaderboard(guild_id, elo_rating DESC)', timeout=MAINTENANCE_TIMEOUT)
+    
+    await conn.execute('''
+        CREATE MATERIALIZED VIEW IF NOT EXISTS mv_servant_leaderboard AS
+        SELECT s.id, s.guild_id, u.user_id, s.servant_name, s.servant_rank, s.level, s.experience
+        FROM summons s
+        JOIN users u ON s.user_id = u.user_id AND s.guild_id = u.guild_id
+    ''', timeout=MAINTENANCE_TIMEOUT)
+    await conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_servant_id ON mv_servant_leaderboard(id)', timeout=MAINTENANCE_TIMEOUT)
+    await conn.execute('CREATE INDEX IF NOT EXISTS idx_mv_servant_guild_level ON mv_servant_leaderboard(guild_id, level DESC, experience DESC)', timeout=MAINTENANCE_TIMEOUT)
+    
+    # Schema version marker (single row)
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            v INTEGER NOT NULL
+        )
+    ''')
+
+async def _create_table_indexes(*indexes: Tuple[str, str]):
+    """Build one table's (name, sql) indexes one after another on a dedicated pool connection"""
+    async with db_pool.acquire() as conn:
+        for name, sql in indexes:
+            await _create_index(conn, name, sql)
+
+async def _create_index(conn, name: str, sql: str):
+    """Build an index concurrently, first dropping an invalid leftover from a failed build"""
+    # A failed CREATE INDEX CONCURRENTLY leaves an INVALID index behind, which
+    # IF NOT EXISTS would otherwise skip forever
+    is_valid = await conn.fetchval(
+        'SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)', name
+    )
+    if is_valid is False:
+        print(f'  Rebuilding invalid index {name}...')
+        await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}', timeout=MAINTENANCE_TIMEOUT)
+    await conn.execute(sql, timeout=MAINTENANCE_TIMEOUT)
 
 async def initialize_default_items(conn):
     """Initialize default items in the database"""
@@ -377,11 +689,14 @@ async def initialize_default_items(conn):
         ("Mana Prism", "Valuable currency item", "currency", "B", None, 0, 0),
     ]
     
+    # Seeding runs on every boot. INSERT ... ON CONFLICT would still draw a value
+    # from the SMALLSERIAL sequence per row, so skip existing rows up front
     for item_data in default_items:
         try:
             await conn.execute('''
                 INSERT INTO items (name, description, item_type, rarity, stat_type, stat_value, price)
-                VALUES ($1, $2, $3, $4, $5, $6, $7)
+                SELECT $1::text, $2::text, $3::text, $4::text, $5::text, $6::int, $7::int
+                WHERE NOT EXISTS (SELECT 1 FROM items WHERE name = $1::text)
                 ON CONFLICT (name) DO NOTHING
             ''', *item_data)
         except:
@@ -397,19 +712,26 @@ async def initialize_default_missions(conn):
         ("use_item", "Equip an item to a servant", 1, 15, 0),
     ]
     
+    # Skip existing rows up front so a reboot draws no SMALLSERIAL values
     for mission_data in default_missions:
         try:
             await conn.execute('''
                 INSERT INTO daily_missions (mission_type, description, requirement, sq_reward, ticket_reward)
-                VALUES ($1, $2, $3, $4, $5)
-                ON CONFLICT DO NOTHING
+                SELECT $1::text, $2::text, $3::int, $4::int, $5::int
+                WHERE NOT EXISTS (SELECT 1 FROM daily_missions WHERE mission_type = $1::text)
+                ON CONFLICT (mission_type) DO NOTHING
             ''', *mission_data)
         except:
             pass
 
 async def close_db():
     """Close database connection pool"""
-    global db_pool
+    global db_pool, _listener_conn
+    if db_pool:
+        await flush_cooldowns()
+    if _listener_conn:
+        await _listener_conn.close()
+        _listener_conn = None
     if db_pool:
         await db_pool.close()
 
@@ -417,72 +739,97 @@ async def close_db():
 # GUILD FUNCTIONS
 # ============================================================================
 
-async def get_or_create_guild(guild_id: int):
+async def get_or_create_guild(guild_id: int, *, conn=None):
     """Get or create guild in database"""
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
         await conn.execute('''
             INSERT INTO guilds (guild_id) 
             VALUES ($1) 
             ON CONFLICT (guild_id) DO NOTHING
         ''', guild_id)
 
-async def get_max_summons(guild_id: int) -> int:
-    """Get max summons for a guild"""
+def _on_guilds_changed(conn, pid, channel, payload):
+    """Drop a guild's cached settings when notified of a change"""
+    _guild_cache.pop(int(payload), None)
+
+async def _get_guild_settings(guild_id: int) -> Dict[str, Any]:
+    """Get cached guild settings, querying the database on miss or expiry"""
+    cached = _guild_cache.get(guild_id)
+    now = time.monotonic()
+    if cached and now - cached[0] < GUILD_CACHE_TTL:
+        return cached[1]
+    
     async with db_pool.acquire() as conn:
-        result = await conn.fetchval('''
-            SELECT max_summons FROM guilds WHERE guild_id = $1
+        row = await conn.fetchrow('''
+            SELECT max_summons, battle_forum_id FROM guilds WHERE guild_id = $1
         ''', guild_id)
-        return result if result else 1
+    
+    settings = {
+        "max_summons": row['max_summons'] if row else None,
+        "battle_forum_id": row['battle_forum_id'] if row else None
+    }
+    _guild_cache[guild_id] = (now, settings)
+    return settings
+
+async def _invalidate_guild_settings(conn, guild_id: int):
+    """Invalidate cached guild settings in this and all other workers"""
+    _guild_cache.pop(guild_id, None)
+    await conn.execute("SELECT pg_notify('guilds_changed', $1)", str(guild_id))
 
-async def set_max_summons(guild_id: int, max_summons: int):
+async def get_max_summons(guild_id: int) -> int:
+    """Get max summons for a guild"""
+    settings = await _get_guild_settings(guild_id)
+    return settings['max_summons'] or 1
+
+async def set_max_summons(guild_id: int, max_summons: int, *, conn=None):
     """Set max summons for a guild"""
-    await get_or_create_guild(guild_id)
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
+        await get_or_create_guild(guild_id, conn=conn)
         await conn.execute('''
             UPDATE guilds SET max_summons = $1 WHERE guild_id = $2
         ''', max_summons, guild_id)
+        await _invalidate_guild_settings(conn, guild_id)
 
-async def set_battle_forum(guild_id: int, forum_id: int):
+async def set_battle_forum(guild_id: int, forum_id: int, *, conn=None):
     """Set battle forum channel for a guild"""
-    await get_or_create_guild(guild_id)
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
+        await get_or_create_guild(guild_id, conn=conn)
         await conn.execute('''
             UPDATE guilds SET battle_forum_id = $1 WHERE guild_id = $2
         ''', forum_id, guild_id)
+        await _invalidate_guild_settings(conn, guild_id)
 
 async def get_battle_forum(guild_id: int) -> Optional[int]:
     """Get battle forum channel ID"""
-    async with db_pool.acquire() as conn:
-        return await conn.fetchval('''
-            SELECT battle_forum_id FROM guilds WHERE guild_id = $1
-        ''', guild_id)
+    settings = await _get_guild_settings(guild_id)
+    return settings['battle_forum_id']
 
 # ============================================================================
 # USER FUNCTIONS
 # ============================================================================
 
-async def register_user(user_id: int, guild_id: int):
+async def register_user(user_id: int, guild_id: int, *, conn=None):
     """Register a user"""
-    await get_or_create_guild(guild_id)
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
+        await get_or_create_guild(guild_id, conn=conn)
         await conn.execute('''
             INSERT INTO users (user_id, guild_id, is_registered, registered_at, saint_quartz, summon_tickets)
-            VALUES ($1, $2, TRUE, $3, 100, 3)
+            VALUES ($1, $2, TRUE, now(), 100, 3)
             ON CONFLICT (user_id, guild_id) 
-            DO UPDATE SET is_registered = TRUE, registered_at = $3
-        ''', user_id, guild_id, datetime.now())
+            DO UPDATE SET is_registered = TRUE, registered_at = EXCLUDED.registered_at
+        ''', user_id, guild_id)
 
-async def is_user_registered(user_id: int, guild_id: int) -> bool:
+async def is_user_registered(user_id: int, guild_id: int, *, conn=None) -> bool:
     """Check if user is registered"""
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
         result = await conn.fetchval('''
             SELECT is_registered FROM users WHERE user_id = $1 AND guild_id = $2
         ''', user_id, guild_id)
         return result if result else False
 
-async def get_user_currency(user_id: int, guild_id: int) -> Dict[str, int]:
+async def get_user_currency(user_id: int, guild_id: int, *, conn=None) -> Dict[str, int]:
     """Get user's currency"""
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
         result = await conn.fetchrow('''
             SELECT saint_quartz, summon_tickets FROM users 
             WHERE user_id = $1 AND guild_id = $2
@@ -492,9 +839,9 @@ async def get_user_currency(user_id: int, guild_id: int) -> Dict[str, int]:
             return {"sq": result['saint_quartz'], "tickets": result['summon_tickets']}
         return {"sq": 0, "tickets": 0}
 
-async def update_user_currency(user_id: int, guild_id: int, sq_change: int = 0, tickets_change: int = 0):
+async def update_user_currency(user_id: int, guild_id: int, sq_change: int = 0, tickets_change: int = 0, *, conn=None):
     """Update user's currency"""
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
         await conn.execute('''
             UPDATE users 
             SET saint_quartz = saint_quartz + $1,
@@ -502,9 +849,9 @@ async def update_user_currency(user_id: int, guild_id: int, sq_change: int = 0,
             WHERE user_id = $3 AND guild_id = $4
         ''', sq_change, tickets_change, user_id, guild_id)
 
-async def claim_daily_reward(user_id: int, guild_id: int) -> Optional[Dict[str, int]]:
+async def claim_daily_reward(user_id: int, guild_id: int, *, conn=None) -> Optional[Dict[str, int]]:
     """Claim daily login reward"""
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
         # Check last claim
         last_claim = await conn.fetchval('''
             SELECT last_daily_claim FROM users 
@@ -550,21 +897,21 @@ async def claim_daily_reward(user_id: int, guild_id: int) -> Optional[Dict[str,
             "streak": streak
         }
 
-async def get_user_stats(user_id: int, guild_id: int) -> Optional[Dict]:
+async def get_user_stats(user_id: int, guild_id: int, *, conn=None) -> Optional[Dict]:
     """Get user statistics"""
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
         return await conn.fetchrow('''
-            SELECT * FROM users WHERE user_id = $1 AND guild_id = $2
+            SELECT saint_quartz, summon_tickets, battle_wins, battle_losses,
+                   elo_rating, total_summons, current_streak, longest_streak
+            FROM users WHERE user_id = $1 AND guild_id = $2
         ''', user_id, guild_id)
 
 # ============================================================================
 # SERVANT/SUMMON FUNCTIONS
 # ============================================================================
 
-async def add_summon(user_id: int, guild_id: int, servant: dict, rank: str) -> int:
+async def add_summon(user_id: int, guild_id: int, servant: dict, rank: str, *, conn=None) -> int:
     """Add a summon for a user and return servant ID"""
-    await get_or_create_guild(guild_id)
-    
     # Calculate base stats based on rank
     rank_multipliers = {
         "EX": 2.0,
@@ -580,7 +927,9 @@ async def add_summon(user_id: int, guild_id: int, servant: dict, rank: str) -> i
     base_hp = int(1000 * multiplier)
     base_speed = int(50 * multiplier)
     
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
+        await get_or_create_guild(guild_id, conn=conn)
+        
         # Ensure user exists
         await conn.execute('''
             INSERT INTO users (user_id, guild_id, saint_quartz, summon_tickets) 
@@ -609,40 +958,45 @@ async def add_summon(user_id: int, guild_id: int, servant: dict, rank: str) -> i
         
         return servant_id
 
-async def get_user_summons(user_id: int, guild_id: int):
+async def get_user_summons(user_id: int, guild_id: int, *, conn=None):
     """Get all summons for a user in a guild"""
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
         return await conn.fetch('''
-            SELECT * FROM summons 
+            SELECT id, servant_name, servant_class, servant_rank, level,
+                   base_attack, base_defense, base_hp, is_favorite,
+                   battles_won, total_battles
+            FROM summons 
             WHERE user_id = $1 AND guild_id = $2 
             ORDER BY is_favorite DESC, level DESC, summoned_at DESC
         ''', user_id, guild_id)
 
-async def get_servant_by_id(servant_id: int):
+async def get_servant_by_id(servant_id: int, *, conn=None):
     """Get servant by ID"""
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
         return await conn.fetchrow('''
-            SELECT * FROM summons WHERE id = $1
+            SELECT id, user_id, guild_id, servant_name, servant_class, servant_rank, level
+            FROM summons WHERE id = $1
         ''', servant_id)
 
-async def remove_summon(summon_id: int, guild_id: int) -> bool:
+async def remove_summon(summon_id: int, guild_id: int, *, conn=None) -> bool:
     """Remove a summon by ID"""
-    async with db_pool.acquire() as conn:
-        result = await conn.execute('''
+    async with _acquire(conn) as conn:
+        deleted = await conn.fetchval('''
             DELETE FROM summons WHERE id = $1 AND guild_id = $2
+            RETURNING 1
         ''', summon_id, guild_id)
-        return result != "DELETE 0"
+        return deleted is not None
 
-async def clear_user_summons(user_id: int, guild_id: int):
+async def clear_user_summons(user_id: int, guild_id: int, *, conn=None):
     """Clear all summons for a user"""
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
         await conn.execute('''
             DELETE FROM summons WHERE user_id = $1 AND guild_id = $2
         ''', user_id, guild_id)
 
-async def toggle_favorite_servant(servant_id: int) -> bool:
+async def toggle_favorite_servant(servant_id: int, *, conn=None) -> bool:
     """Toggle favorite status of a servant"""
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
         new_status = await conn.fetchval('''
             UPDATE summons 
             SET is_favorite = NOT is_favorite
@@ -655,10 +1009,10 @@ async def toggle_favorite_servant(servant_id: int) -> bool:
 # LEVELING FUNCTIONS
 # ============================================================================
 
-async def add_experience(servant_id: int, exp: int) -> Dict:
+async def add_experience(servant_id: int, exp: int, *, conn=None) -> Optional[LevelResult]:
     """Add experience to a servant and handle level ups"""
-    async with db_pool.acquire() as conn:
-        servant = await conn.fetchrow('SELECT * FROM summons WHERE id = $1', servant_id)
+    async with _acquire(conn) as conn:
+        servant = await conn.fetchrow('SELECT level, experience FROM summons WHERE id = $1', servant_id)
         
         if not servant:
             return None
@@ -701,145 +1055,191 @@ async def add_experience(servant_id: int, exp: int) -> Dict:
             "exp_needed": current_level * 100
         }
 
-async def get_servant_stats(servant_id: int) -> Dict:
+async def get_servant_stats(servant_id: int, *, conn=None) -> Optional[ServantStats]:
     """Get total stats for a servant (base + bonuses + equipment)"""
-    async with db_pool.acquire() as conn:
-        servant = await conn.fetchrow('SELECT * FROM summons WHERE id = $1', servant_id)
-        
-        if not servant:
-            return None
-        
-        # Get equipped items bonuses
-        equipped_items = await conn.fetch('''
-            SELECT i.stat_type, i.stat_value 
-            FROM equipped_items ei
-            JOIN items i ON ei.item_id = i.id
-            WHERE ei.servant_id = $1 AND i.stat_type IS NOT NULL
-        ''', servant_id)
-        
-        item_bonuses = {
-            "attack": 0,
-            "defense": 0,
-            "hp": 0,
-            "speed": 0
-        }
-        
-        for item in equipped_items:
-            if item['stat_type'] in item_bonuses:
-                item_bonuses[item['stat_type']] += item['stat_value']
-        
-        return {
-            "id": servant['id'],
-            "name": servant['servant_name'],
-            "class": servant['servant_class'],
-            "rank": servant['servant_rank'],
-            "level": servant['level'],
-            "attack": servant['base_attack'] + servant['bonus_attack'] + item_bonuses['attack'],
-            "defense": servant['base_defense'] + servant['bonus_defense'] + item_bonuses['defense'],
-            "hp": servant['base_hp'] + servant['bonus_hp'] + item_bonuses['hp'],
-            "speed": servant['base_speed'] + servant['bonus_speed'] + item_bonuses['speed'],
-            "wins": servant['battles_won'],
-            "total_battles": servant['total_battles']
+    stats = await get_servants_stats([servant_id], conn=conn)
+    return stats.get(servant_id)
+
+async def get_servants_stats(servant_ids: List[int], *, conn=None) -> Dict[int, ServantStats]:
+    """Get total stats for several servants in one query, keyed by servant id"""
+    if not servant_ids:
+        return {}
+    
+    async with _acquire(conn) as conn:
+        # Equipped item bonuses are summed per stat in the same statement
+        rows = await conn.fetch('''
+            SELECT s.id, s.servant_name, s.servant_class, s.servant_rank, s.level,
+                   s.base_attack + s.bonus_attack + COALESCE(eq.attack, 0) AS attack,
+                   s.base_defense + s.bonus_defense + COALESCE(eq.defense, 0) AS defense,
+                   s.base_hp + s.bonus_hp + COALESCE(eq.hp, 0) AS hp,
+                   s.base_speed + s.bonus_speed + COALESCE(eq.speed, 0) AS speed,
+                   s.battles_won, s.total_battles
+            FROM summons s
+            LEFT JOIN (
+                SELECT ei.servant_id,
+                       SUM(i.stat_value) FILTER (WHERE i.stat_type = 'attack') AS attack,
+                       SUM(i.stat_value) FILTER (WHERE i.stat_type = 'defense') AS defense,
+                       SUM(i.stat_value) FILTER (WHERE i.stat_type = 'hp') AS hp,
+                       SUM(i.stat_value) FILTER (WHERE i.stat_type = 'speed') AS speed
+                FROM equipped_items ei
+                JOIN items i ON ei.item_id = i.id
+                WHERE ei.servant_id = ANY($1::bigint[])
+                GROUP BY ei.servant_id
+            ) eq ON eq.servant_id = s.id
+            WHERE s.id = ANY($1::bigint[])
+        ''', servant_ids)
+    
+    return {
+        row['id']: {
+            "id": row['id'],
+            "name": row['servant_name'],
+            "class": row['servant_class'],
+            "rank": row['servant_rank'],
+            "level": row['level'],
+            "attack": row['attack'],
+            "defense": row['defense'],
+            "hp": row['hp'],
+            "speed": row['speed'],
+            "wins": row['battles_won'],
+            "total_battles": row['total_battles']
         }
+        for row in rows
+    }
 
 # ============================================================================
 # ITEM & EQUIPMENT FUNCTIONS
 # ============================================================================
 
-async def get_item_by_name(item_name: str):
+async def prime_catalog_caches(*, conn=None):
+    """Load the items and daily missions catalogs into the in-process cache"""
+    global _catalog_primed, _all_items, _all_missions
+    async with _acquire(conn) as conn:
+        items = await conn.fetch('SELECT * FROM items ORDER BY rarity DESC, price DESC')
+        missions = await conn.fetch('SELECT * FROM daily_missions ORDER BY id')
+    
+    _items_by_id.clear()
+    _items_by_id.update({item['id']: item for item in items})
+    _items_by_name.clear()
+    _items_by_name.update({item['name']: item for item in items})
+    _all_items = tuple(items)
+    
+    # Keep the first (lowest id) row per mission type, the one claims are checked against
+    _missions_by_type.clear()
+    for mission in missions:
+        _missions_by_type.setdefault(mission['mission_type'], mission)
+    _all_missions = tuple(_missions_by_type.values())
+    
+    _catalog_primed = True
+
+def invalidate_catalog_caches():
+    """Force the catalog cache to reload on next use (call after editing items or missions)"""
+    global _catalog_primed
+    _catalog_primed = False
+
+async def _ensure_catalog(conn=None):
+    """Prime the catalog cache if it has not been loaded yet"""
+    if not _catalog_primed:
+        await prime_catalog_caches(conn=conn)
+
+async def get_item_by_name(item_name: str, *, conn=None):
     """Get item by name"""
-    async with db_pool.acquire() as conn:
-        return await conn.fetchrow('''
-            SELECT * FROM items WHERE name = $1
-        ''', item_name)
+    await _ensure_catalog(conn)
+    return _items_by_name.get(item_name)
 
-async def get_all_items():
+async def get_all_items(*, conn=None):
     """Get all available items"""
-    async with db_pool.acquire() as conn:
-        return await conn.fetch('SELECT * FROM items ORDER BY rarity DESC, price DESC')
+    await _ensure_catalog(conn)
+    return _all_items
 
-async def get_user_inventory(user_id: int, guild_id: int):
+_USER_INVENTORY_SQL = _hot_sql('''
+    SELECT i.id, i.name, i.description, i.item_type, i.rarity,
+           i.stat_type, i.stat_value, inv.quantity
+    FROM inventory inv
+    JOIN items i ON inv.item_id = i.id
+    WHERE inv.user_id = $1 AND inv.guild_id = $2
+    ORDER BY i.rarity DESC, i.price DESC
+''')
+
+async def get_user_inventory(user_id: int, guild_id: int, *, conn=None):
     """Get user's inventory"""
-    async with db_pool.acquire() as conn:
-        return await conn.fetch('''
-            SELECT i.*, inv.quantity, inv.acquired_at
-            FROM inventory inv
-            JOIN items i ON inv.item_id = i.id
-            WHERE inv.user_id = $1 AND inv.guild_id = $2
-            ORDER BY i.rarity DESC, i.price DESC
-        ''', user_id, guild_id)
+    async with _acquire(conn) as conn:
+        return await conn.fetch(_USER_INVENTORY_SQL, user_id, guild_id)
+
+_ADD_ITEM_TO_INVENTORY_SQL = _hot_sql('''
+    INSERT INTO inventory (user_id, guild_id, item_id, quantity)
+    VALUES ($1, $2, $3, $4)
+    ON CONFLICT (user_id, guild_id, item_id) 
+    DO UPDATE SET quantity = inventory.quantity + $4
+''')
 
-async def add_item_to_inventory(user_id: int, guild_id: int, item_id: int, quantity: int = 1):
+async def add_item_to_inventory(user_id: int, guild_id: int, item_id: int, quantity: int = 1, *, conn=None):
     """Add item to user's inventory"""
-    async with db_pool.acquire() as conn:
-        await conn.execute('''
+    async with _acquire(conn) as conn:
+        await conn.execute(_ADD_ITEM_TO_INVENTORY_SQL, user_id, guild_id, item_id, quantity)
+
+async def add_items_to_inventory(user_id: int, guild_id: int, items: List[Tuple[int, int]], *, conn=None):
+    """Add several (item_id, quantity) pairs to a user's inventory in one batch"""
+    if not items:
+        return
+    
+    async with _acquire(conn) as conn:
+        await conn.executemany('''
             INSERT INTO inventory (user_id, guild_id, item_id, quantity)
             VALUES ($1, $2, $3, $4)
             ON CONFLICT (user_id, guild_id, item_id) 
-            DO UPDATE SET quantity = inventory.quantity + $4
-        ''', user_id, guild_id, item_id, quantity)
+            DO UPDATE SET quantity = inventory.quantity + EXCLUDED.quantity
+        ''', [(user_id, guild_id, item_id, quantity) for item_id, quantity in items])
 
-async def remove_item_from_inventory(user_id: int, guild_id: int, item_id: int, quantity: int = 1) -> bool:
+async def remove_item_from_inventory(user_id: int, guild_id: int, item_id: int, quantity: int = 1, *, conn=None) -> bool:
     """Remove item from inventory"""
-    async with db_pool.acquire() as conn:
-        current_qty = await conn.fetchval('''
-            SELECT quantity FROM inventory 
-            WHERE user_id = $1 AND guild_id = $2 AND item_id = $3
-        ''', user_id, guild_id, item_id)
-        
-        if not current_qty or current_qty < quantity:
-            return False
-        
-        if current_qty == quantity:
-            await conn.execute('''
-                DELETE FROM inventory 
-                WHERE user_id = $1 AND guild_id = $2 AND item_id = $3
-            ''', user_id, guild_id, item_id)
-        else:
-            await conn.execute('''
+    async with _acquire(conn) as conn:
+        # Decrement or delete in one statement; the predicates are exclusive so
+        # only one branch can touch the row, and neither matches if too few are held
+        removed = await conn.fetchval('''
+            WITH decremented AS (
                 UPDATE inventory SET quantity = quantity - $4
-                WHERE user_id = $1 AND guild_id = $2 AND item_id = $3
-            ''', user_id, guild_id, item_id, quantity)
+                WHERE user_id = $1 AND guild_id = $2 AND item_id = $3 AND quantity > $4
+                RETURNING 1
+            ),
+            deleted AS (
+                DELETE FROM inventory 
+                WHERE user_id = $1 AND guild_id = $2 AND item_id = $3 AND quantity = $4
+                RETURNING 1
+            )
+            SELECT 1 FROM decremented UNION ALL SELECT 1 FROM deleted
+        ''', user_id, guild_id, item_id, quantity)
         
-        return True
+        return removed is not None
 
-async def equip_item(servant_id: int, item_id: int, slot_type: str) -> bool:
+async def equip_item(servant_id: int, item_id: int, slot_type: str, *, conn=None) -> bool:
     """Equip item to servant"""
-    async with db_pool.acquire() as conn:
-        # Check if slot is already occupied
-        existing = await conn.fetchval('''
-            SELECT id FROM equipped_items 
-            WHERE servant_id = $1 AND slot_type = $2
-        ''', servant_id, slot_type)
-        
-        if existing:
-            # Unequip old item
-            await conn.execute('''
-                DELETE FROM equipped_items WHERE id = $1
-            ''', existing)
-        
-        # Equip new item
+    async with _acquire(conn) as conn:
+        # Replace whatever occupies the slot in a single statement
         await conn.execute('''
+            WITH unequipped AS (
+                DELETE FROM equipped_items 
+                WHERE servant_id = $1 AND slot_type = $3
+            )
             INSERT INTO equipped_items (servant_id, item_id, slot_type)
             VALUES ($1, $2, $3)
         ''', servant_id, item_id, slot_type)
         
         return True
 
-async def unequip_item(servant_id: int, slot_type: str) -> bool:
+async def unequip_item(servant_id: int, slot_type: str, *, conn=None) -> bool:
     """Unequip item from servant"""
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
         result = await conn.execute('''
             DELETE FROM equipped_items 
             WHERE servant_id = $1 AND slot_type = $2
         ''', servant_id, slot_type)
         return result != "DELETE 0"
 
-async def get_equipped_items(servant_id: int):
+async def get_equipped_items(servant_id: int, *, conn=None):
     """Get all equipped items for a servant"""
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
         return await conn.fetch('''
-            SELECT ei.*, i.name, i.description, i.item_type, i.rarity, i.stat_type, i.stat_value
+            SELECT ei.item_id, ei.slot_type, i.name, i.description, i.rarity, i.stat_type, i.stat_value
             FROM equipped_items ei
             JOIN items i ON ei.item_id = i.id
             WHERE ei.servant_id = $1
@@ -856,10 +1256,12 @@ async def create_battle(
     challenger_servant_id: int,
     opponent_servant_id: int,
     forum_thread_id: Optional[int] = None,
-    battle_type: str = "ranked"
+    battle_type: str = "ranked",
+    *,
+    conn=None
 ) -> int:
     """Create a new battle"""
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
         battle_id = await conn.fetchval('''
             INSERT INTO battles (
                 guild_id, challenger_id, opponent_id,
@@ -879,134 +1281,223 @@ async def complete_battle(
     winner_id: int,
     battle_log: str,
     elo_change: int,
-    exp_gained: int
+    exp_gained: int,
+    *,
+    conn=None
 ):
     """Complete a battle and update stats"""
-    async with db_pool.acquire() as conn:
-        battle = await conn.fetchrow('SELECT * FROM battles WHERE id = $1', battle_id)
-        
-        if not battle:
-            return
-        
-        loser_id = battle['opponent_id'] if winner_id == battle['challenger_id'] else battle['challenger_id']
-        winner_servant_id = battle['challenger_servant_id'] if winner_id == battle['challenger_id'] else battle['opponent_servant_id']
-        loser_servant_id = battle['opponent_servant_id'] if winner_id == battle['challenger_id'] else battle['challenger_servant_id']
-        
-        # Update battle record
-        await conn.execute('''
-            UPDATE battles 
-            SET winner_id = $1, battle_log = $2, elo_change = $3, 
-                experience_gained = $4, completed_at = $5
-            WHERE id = $6
-        ''', winner_id, battle_log, elo_change, exp_gained, datetime.now(), battle_id)
-        
-        # Update user stats
-        await conn.execute('''
-            UPDATE users 
-            SET battle_wins = battle_wins + 1,
-                elo_rating = elo_rating + $1
-            WHERE user_id = $2 AND guild_id = $3
-        ''', elo_change, winner_id, battle['guild_id'])
-        
-        await conn.execute('''
-            UPDATE users 
-            SET battle_losses = battle_losses + 1,
-                elo_rating = GREATEST(elo_rating - $1, 0),
-                current_streak = 0
-            WHERE user_id = $2 AND guild_id = $3
-        ''', elo_change, loser_id, battle['guild_id'])
-        
-        # Update servant stats
-        await conn.execute('''
-            UPDATE summons 
-            SET battles_won = battles_won + 1,
-                total_battles = total_battles + 1,
-                last_battle = $1
-            WHERE id = $2
-        ''', datetime.now(), winner_servant_id)
-        
-        await conn.execute('''
-            UPDATE summons 
-            SET total_battles = total_battles + 1,
-                last_battle = $1
-            WHERE id = $2
-        ''', datetime.now(), loser_servant_id)
-        
-        # Add experience to winner's servant
-        await add_experience(winner_servant_id, exp_gained)
+    async with _acquire(conn) as conn:
+        # One connection and one transaction: either every stat moves or none do
+        async with conn.transaction():
+            # Record the result, log, user stats and servant stats in one round-trip.
+            # Loser and servant ids are derived from the battles row inside SQL.
+            # The UPDATE row-locks the battle and re-checks winner_id IS NULL, so a
+            # concurrent second completion matches nothing and credits nobody.
+            winner_servant_id = await conn.fetchval('''
+                WITH b AS (
+                    UPDATE battles 
+                    SET winner_id = $1, elo_change = $3, 
+                        experience_gained = $4, completed_at = now()
+                    WHERE id = $5 AND winner_id IS NULL
+                    RETURNING id, guild_id,
+                        CASE WHEN challenger_id = $1 THEN opponent_id ELSE challenger_id END AS loser_id,
+                        CASE WHEN challenger_id = $1 THEN challenger_servant_id ELSE opponent_servant_id END AS winner_servant_id,
+                        CASE WHEN challenger_id = $1 THEN opponent_servant_id ELSE challenger_servant_id END AS loser_servant_id
+                ),
+                log AS (
+                    INSERT INTO battle_logs (battle_id, log)
+                    SELECT id, $2 FROM b
+                    ON CONFLICT (battle_id) DO UPDATE SET log = EXCLUDED.log
+                ),
+                w AS (
+                    UPDATE users 
+                    SET battle_wins = battle_wins + 1,
+                        elo_rating = elo_rating + $3
+                    FROM b
+                    WHERE users.user_id = $1 AND users.guild_id = b.guild_id
+                ),
+                l AS (
+                    UPDATE users 
+                    SET battle_losses = battle_losses + 1,
+                        elo_rating = GREATEST(elo_rating - $3, 0),
+                        current_streak = 0
+                    FROM b
+                    WHERE users.user_id = b.loser_id AND users.guild_id = b.guild_id
+                ),
+                ws AS (
+                    UPDATE summons 
+                    SET battles_won = battles_won + 1,
+                        total_battles = total_battles + 1,
+                        last_battle = now()
+                    FROM b
+                    WHERE summons.id = b.winner_servant_id
+                ),
+                ls AS (
+                    UPDATE summons 
+                    SET total_battles = total_battles + 1,
+                        last_battle = now()
+                    FROM b
+                    WHERE summons.id = b.loser_servant_id
+                )
+                SELECT winner_servant_id FROM b
+            ''', winner_id, battle_log, elo_change, exp_gained, battle_id)
+        
+            if winner_servant_id is None:
+                return
+        
+            # Add experience to winner's servant
+            await add_experience(winner_servant_id, exp_gained, conn=conn)
+
+# Two range scans on the (guild, side, completed_at) indexes, merged top-k,
+# instead of a bitmap OR over both sides
+_USER_BATTLE_HISTORY_SQL = _hot_sql('''
+    (SELECT id, challenger_id, opponent_id, challenger_servant_id, opponent_servant_id,
+            winner_id, elo_change, experience_gained, battle_type, completed_at
+     FROM battles
+     WHERE guild_id = $1 AND challenger_id = $2
+     AND completed_at IS NOT NULL
+     ORDER BY completed_at DESC
+     LIMIT $3)
+    UNION ALL
+    (SELECT id, challenger_id, opponent_id, challenger_servant_id, opponent_servant_id,
+            winner_id, elo_change, experience_gained, battle_type, completed_at
+     FROM battles
+     WHERE guild_id = $1 AND opponent_id = $2 AND challenger_id <> $2
+     AND completed_at IS NOT NULL
+     ORDER BY completed_at DESC
+     LIMIT $3)
+    ORDER BY completed_at DESC
+    LIMIT $3
+''')
 
-async def get_user_battle_history(user_id: int, guild_id: int, limit: int = 10):
+async def get_user_battle_history(user_id: int, guild_id: int, limit: int = 10, *, conn=None):
     """Get user's recent battles"""
-    async with db_pool.acquire() as conn:
-        return await conn.fetch('''
-            SELECT * FROM battles
-            WHERE guild_id = $1 
-            AND (challenger_id = $2 OR opponent_id = $2)
-            AND completed_at IS NOT NULL
-            ORDER BY completed_at DESC
-            LIMIT $3
-        ''', guild_id, user_id, limit)
+    async with _acquire(conn) as conn:
+        return await conn.fetch(_USER_BATTLE_HISTORY_SQL, guild_id, user_id, limit)
 
 # ============================================================================
 # COOLDOWN FUNCTIONS
 # ============================================================================
 
+async def load_cooldowns(*, conn=None):
+    """Purge expired cooldowns and load the active ones from the database into memory"""
+    async with _acquire(conn) as conn:
+        rows = await conn.fetch('''
+            WITH purged AS (
+                DELETE FROM cooldowns WHERE expires_at <= $1
+            )
+            SELECT user_id, guild_id, action_type, expires_at FROM cooldowns
+            WHERE expires_at > $1
+        ''', datetime.now())
+    
+    _cooldowns.clear()
+    _cooldown_expiries.clear()
+    for row in rows:
+        key = (row['user_id'], row['guild_id'], row['action_type'])
+        _cooldowns[key] = row['expires_at']
+        _cooldown_expiries.append((row['expires_at'], key))
+    heapq.heapify(_cooldown_expiries)
+
 async def check_cooldown(user_id: int, guild_id: int, action_type: str) -> Optional[datetime]:
     """Check if user has an active cooldown for an action"""
-    async with db_pool.acquire() as conn:
-        expires_at = await conn.fetchval('''
-            SELECT expires_at FROM cooldowns
-            WHERE user_id = $1 AND guild_id = $2 AND action_type = $3
-            AND expires_at > $4
-        ''', user_id, guild_id, action_type, datetime.now())
-        
+    expires_at = _cooldowns.get((user_id, guild_id, action_type))
+    if expires_at and expires_at > datetime.now():
         return expires_at
+    return None
 
 async def set_cooldown(user_id: int, guild_id: int, action_type: str, duration_seconds: int):
-    """Set a cooldown for a user action"""
+    """Set a cooldown for a user action (written to the database by flush_cooldowns)"""
+    key = (user_id, guild_id, action_type)
     expires_at = datetime.now() + timedelta(seconds=duration_seconds)
+    _cooldowns[key] = expires_at
+    _pending_cooldowns[key] = expires_at
+    heapq.heappush(_cooldown_expiries, (expires_at, key))
+
+async def flush_cooldowns(*, conn=None):
+    """Write all buffered cooldowns to the database in one batch"""
+    if not _pending_cooldowns:
+        return
     
-    async with db_pool.acquire() as conn:
-        await conn.execute('''
-            INSERT INTO cooldowns (user_id, guild_id, action_type, expires_at)
-            VALUES ($1, $2, $3, $4)
-            ON CONFLICT (user_id, guild_id, action_type)
-            DO UPDATE SET expires_at = $4
-        ''', user_id, guild_id, action_type, expires_at)
+    rows = [(*key, expires_at) for key, expires_at in _pending_cooldowns.items()]
+    _pending_cooldowns.clear()
+    
+    # On failure the batch is dropped rather than retried, so one bad row cannot
+    # wedge the writer; this process still enforces the cooldowns from memory
+    try:
+        async with _acquire(conn) as conn:
+            await conn.executemany('''
+                INSERT INTO cooldowns (user_id, guild_id, action_type, expires_at)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT (user_id, guild_id, action_type)
+                DO UPDATE SET expires_at = $4
+            ''', rows)
+    except Exception as e:
+        print(f'  ✗ Failed to flush {len(rows)} cooldown(s): {e}')
 
 async def clear_expired_cooldowns():
-    """Clear all expired cooldowns"""
-    async with db_pool.acquire() as conn:
-        await conn.execute('''
-            DELETE FROM cooldowns WHERE expires_at <= $1
-        ''', datetime.now())
+    """Clear all expired cooldowns from memory"""
+    # Database rows are left in place: there is at most one per (user, guild, action),
+    # the next set_cooldown overwrites it, and load_cooldowns purges the rest on startup
+    now = datetime.now()
+    while _cooldown_expiries and _cooldown_expiries[0][0] <= now:
+        expires_at, key = heapq.heappop(_cooldown_expiries)
+        # Skip heap entries superseded by a later set_cooldown
+        if _cooldowns.get(key) == expires_at:
+            del _cooldowns[key]
 
 # ============================================================================
 # LEADERBOARD FUNCTIONS
 # ============================================================================
 
-async def get_elo_leaderboard(guild_id: int, limit: int = 10):
+async def refresh_leaderboards(*, conn=None):
+    """Refresh the leaderboard materialized views without blocking readers"""
+    # Errors are logged rather than raised: tasks.loop stops for good on any
+    # exception it does not retry, which would freeze the leaderboards
+    try:
+        async with _acquire(conn) as conn:
+            await conn.execute('REFRESH MATERIALIZED VIEW CONCURRENTLY mv_elo_leaderboard', timeout=MAINTENANCE_TIMEOUT)
+            await conn.execute('REFRESH MATERIALIZED VIEW CONCURRENTLY mv_servant_leaderboard', timeout=MAINTENANCE_TIMEOUT)
+    except Exception as e:
+        print(f'  ✗ Failed to refresh leaderboards: {e}')
+        return
+    leaderboard_cache_clear()
+
+def leaderboard_cache_clear():
+    """Drop all cached leaderboard pages so the next read hits the views"""
+    _leaderboard_cache.clear()
+
+async def _cached_leaderboard(board: str, guild_id: int, limit: int, sql: str, conn=None) -> List[asyncpg.Record]:
+    """Serve a leaderboard page from memory, re-reading it once per cache epoch"""
+    key = (board, guild_id, limit)
+    epoch = int(time.time() // LEADERBOARD_CACHE_TTL)
+    cached = _leaderboard_cache.get(key)
+    if cached and cached[0] == epoch:
+        return cached[1]
+    
+    async with _acquire(conn) as conn:
+        rows = await conn.fetch(sql, guild_id, limit)
+    _leaderboard_cache[key] = (epoch, rows)
+    return rows
+
+async def get_elo_leaderboard(guild_id: int, limit: int = 10, *, conn=None):
     """Get top players by ELO rating"""
-    async with db_pool.acquire() as conn:
-        return await conn.fetch('''
-            SELECT user_id, elo_rating, battle_wins, battle_losses
-            FROM users
-            WHERE guild_id = $1 AND is_registered = TRUE
-            ORDER BY elo_rating DESC
-            LIMIT $2
-        ''', guild_id, limit)
+    return await _cached_leaderboard('elo', guild_id, limit, '''
+        SELECT user_id, elo_rating, battle_wins, battle_losses
+        FROM mv_elo_leaderboard
+        WHERE guild_id = $1
+        ORDER BY elo_rating DESC
+        LIMIT $2
+    ''', conn)
 
-async def get_servant_leaderboard(guild_id: int, limit: int = 10):
+async def get_servant_leaderboard(guild_id: int, limit: int = 10, *, conn=None):
     """Get top servants by level"""
-    async with db_pool.acquire() as conn:
-        return await conn.fetch('''
-            SELECT s.*, u.user_id
-            FROM summons s
-            JOIN users u ON s.user_id = u.user_id AND s.guild_id = u.guild_id
-            WHERE s.guild_id = $1
-            ORDER BY s.level DESC, s.experience DESC
-            LIMIT $2
-        ''', guild_id, limit)
+    return await _cached_leaderboard('servant', guild_id, limit, '''
+        SELECT id, user_id, servant_name, servant_rank, level, experience
+        FROM mv_servant_leaderboard
+        WHERE guild_id = $1
+        ORDER BY level DESC, experience DESC
+        LIMIT $2
+    ''', conn)
 
 # ============================================================================
 # ADMIN LOG FUNCTIONS
@@ -1017,20 +1508,23 @@ async def log_admin_action(
     admin_id: int,
     action_type: str,
     target_user_id: Optional[int] = None,
-    details: Optional[str] = None
+    details: Optional[str] = None,
+    *,
+    conn=None
 ):
     """Log an admin action"""
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
         await conn.execute('''
             INSERT INTO admin_logs (guild_id, admin_id, action_type, target_user_id, details)
             VALUES ($1, $2, $3, $4, $5)
         ''', guild_id, admin_id, action_type, target_user_id, details)
 
-async def get_admin_logs(guild_id: int, limit: int = 50):
+async def get_admin_logs(guild_id: int, limit: int = 50, *, conn=None):
     """Get recent admin actions"""
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
         return await conn.fetch('''
-            SELECT * FROM admin_logs
+            SELECT admin_id, target_user_id, action_type, details, created_at
+            FROM admin_logs
             WHERE guild_id = $1
             ORDER BY created_at DESC
             LIMIT $2
@@ -1040,19 +1534,19 @@ async def get_admin_logs(guild_id: int, limit: int = 50):
 # REGISTRATION FUNCTIONS
 # ============================================================================
 
-async def set_registration_config(guild_id: int, role_id: int, channel_id: int, message_id: int):
+async def set_registration_config(guild_id: int, role_id: int, channel_id: int, message_id: int, *, conn=None):
     """Set registration configuration"""
-    await get_or_create_guild(guild_id)
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
+        await get_or_create_guild(guild_id, conn=conn)
         await conn.execute('''
             UPDATE guilds 
             SET registration_role_id = $1, registration_channel_id = $2, registration_message_id = $3
             WHERE guild_id = $4
         ''', role_id, channel_id, message_id, guild_id)
 
-async def get_registration_config(guild_id: int):
+async def get_registration_config(guild_id: int, *, conn=None):
     """Get registration configuration"""
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
         return await conn.fetchrow('''
             SELECT registration_role_id, registration_channel_id, registration_message_id
             FROM guilds WHERE guild_id = $1
@@ -1062,56 +1556,62 @@ async def get_registration_config(guild_id: int):
 # MISSION FUNCTIONS
 # ============================================================================
 
-async def get_daily_missions():
+async def get_daily_missions(*, conn=None):
     """Get all daily missions"""
-    async with db_pool.acquire() as conn:
-        return await conn.fetch('SELECT * FROM daily_missions')
+    await _ensure_catalog(conn)
+    return _all_missions
 
-async def get_user_mission_progress(user_id: int, guild_id: int):
-    """Get user's mission progress for today"""
-    async with db_pool.acquire() as conn:
-        return await conn.fetch('''
-            SELECT ump.*, dm.description, dm.requirement, dm.sq_reward, dm.ticket_reward
-            FROM user_mission_progress ump
-            JOIN daily_missions dm ON ump.mission_id = dm.id
-            WHERE ump.user_id = $1 AND ump.guild_id = $2 AND ump.reset_date = CURRENT_DATE
+_UPDATE_MISSION_PROGRESS_SQL = _hot_sql('''
+    INSERT INTO user_mission_progress (user_id, guild_id, mission_id, progress, reset_date, completed)
+    VALUES ($1, $2, $3, $4::int, CURRENT_DATE, $4::int >= $5::int)
+    ON CONFLICT (user_id, guild_id, mission_id, reset_date)
+    DO UPDATE SET progress = user_mission_progress.progress + $4::int,
+                  completed = user_mission_progress.progress + $4::int >= $5::int
+''')
+
+async def get_user_mission_progress(user_id: int, guild_id: int, *, conn=None) -> List[Dict[str, Any]]:
+    """Get every daily mission with the user's progress for today (zero if not started)"""
+    async with _acquire(conn) as conn:
+        await _ensure_catalog(conn)
+        rows = await conn.fetch('''
+            SELECT mission_id, progress, completed, claimed
+            FROM user_mission_progress
+            WHERE user_id = $1 AND guild_id = $2 AND reset_date = CURRENT_DATE
         ''', user_id, guild_id)
+    
+    # Mission details come from the catalog cache; only progress is read from the database
+    progress_map = {row['mission_id']: row for row in rows}
+    result = []
+    for mission in _all_missions:
+        progress = progress_map.get(mission['id'])
+        result.append({
+            "mission_id": mission['id'],
+            "mission_type": mission['mission_type'],
+            "description": mission['description'],
+            "requirement": mission['requirement'],
+            "sq_reward": mission['sq_reward'],
+            "ticket_reward": mission['ticket_reward'],
+            "progress": progress['progress'] if progress else 0,
+            "completed": progress['completed'] if progress else False,
+            "claimed": progress['claimed'] if progress else False
+        })
+    return result
 
-async def update_mission_progress(user_id: int, guild_id: int, mission_type: str, amount: int = 1):
+async def update_mission_progress(user_id: int, guild_id: int, mission_type: str, amount: int = 1, *, conn=None):
     """Update progress for a mission type"""
-    async with db_pool.acquire() as conn:
-        # Get mission ID
-        mission = await conn.fetchrow('''
-            SELECT id, requirement FROM daily_missions WHERE mission_type = $1
-        ''', mission_type)
-        
-        if not mission:
-            return
-        
-        # Update or create progress
-        await conn.execute('''
-            INSERT INTO user_mission_progress (user_id, guild_id, mission_id, progress, reset_date)
-            VALUES ($1, $2, $3, $4, CURRENT_DATE)
-            ON CONFLICT (user_id, guild_id, mission_id, reset_date)
-            DO UPDATE SET progress = user_mission_progress.progress + $4
-        ''', user_id, guild_id, mission['id'], amount)
-        
-        # Check if completed
-        current_progress = await conn.fetchval('''
-            SELECT progress FROM user_mission_progress
-            WHERE user_id = $1 AND guild_id = $2 AND mission_id = $3 AND reset_date = CURRENT_DATE
-        ''', user_id, guild_id, mission['id'])
-        
-        if current_progress >= mission['requirement']:
-            await conn.execute('''
-                UPDATE user_mission_progress 
-                SET completed = TRUE
-                WHERE user_id = $1 AND guild_id = $2 AND mission_id = $3 AND reset_date = CURRENT_DATE
-            ''', user_id, guild_id, mission['id'])
+    await _ensure_catalog(conn)
+    mission = _missions_by_type.get(mission_type)
+    
+    if not mission:
+        return
+    
+    async with _acquire(conn) as conn:
+        # Update or create progress, marking completion in the same statement
+        await conn.execute(_UPDATE_MISSION_PROGRESS_SQL, user_id, guild_id, mission['id'], amount, mission['requirement'])
 
-async def claim_mission_reward(user_id: int, guild_id: int, mission_id: int) -> Optional[Dict]:
+async def claim_mission_reward(user_id: int, guild_id: int, mission_id: int, *, conn=None) -> Optional[Dict]:
     """Claim reward for a completed mission"""
-    async with db_pool.acquire() as conn:
+    async with _acquire(conn) as conn:
         # Check if mission is completed and not claimed
         progress = await conn.fetchrow('''
             SELECT * FROM user_mission_progress
@@ -1128,7 +1628,7 @@ async def claim_mission_reward(user_id: int, guild_id: int, mission_id: int) ->
         ''', mission_id)
         
         # Give rewards
-        await update_user_currency(user_id, guild_id, mission['sq_reward'], mission['ticket_reward'])
+        await update_user_currency(user_id, guild_id, mission['sq_reward'], mission['ticket_reward'], conn=conn)
         
         # Mark as claimed
         await conn.execute('''
@@ -1,4 +1,12 @@
-import discord
+import sys
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Final
+
+if TYPE_CHECKING:
+    import discord
 
 # All Fate series Servants organized by canonical power scaling
 SERVANTS = {
@@ -94,81 +102,203 @@ SERVANTS = {
     ],
 }
 
-def get_rank_color(rank: str) -> discord.Color:
+# ============================================================================
+# LOOKUP INDEXES (built once at import; SERVANTS is static)
+# ============================================================================
+
+# Canonical rank keys, strongest first. Every 'rank' value handed out below is one
+# of these objects, so their hashes are computed once and dict probes compare by identity.
+_RANK_KEYS = tuple(sys.intern(rank) for rank in SERVANTS)
+
+# The shared class names are interned, so every "Saber" is one string object
+for _servants in SERVANTS.values():
+    for _servant in _servants:
+        _servant['class'] = sys.intern(_servant['class'])
+
+# Every servant with its rank attached, in rank order. One canonical read-only
+# view per servant, returned directly by every lookup below without copying.
+_ALL_SERVANTS = tuple(
+    MappingProxyType({**servant, 'rank': rank})
+    for rank in _RANK_KEYS
+    for servant in SERVANTS[rank]
+)
+
+# Interned lowercase names, lowered once here so lookups never lower() them.
+# Substring search scans this one contiguous tuple; _SERVANT_REFS[i] is the
+# servant for _LOWER_NAMES[i]. Tuples, since these never grow.
+_LOWER_NAMES = tuple(sys.intern(servant['name'].lower()) for servant in _ALL_SERVANTS)
+_SERVANT_REFS = _ALL_SERVANTS
+
+# Exact lowercase name -> servant; the first occurrence in rank order wins.
+# A plain dict is already the best exact-match structure here: str hashes are
+# cached on the interned keys, so a probe is one C-level lookup.
+_NAME_INDEX = {}
+for _name, _servant in zip(_LOWER_NAMES, _ALL_SERVANTS):
+    _NAME_INDEX.setdefault(_name, _servant)
+del _name, _servant
+
+# Trigram -> indexes into _LOWER_NAMES, to narrow substring search to a few candidates
+_TRIGRAMS = {}
+for _i, _name in enumerate(_LOWER_NAMES):
+    for _trigram in {_name[j:j + 3] for j in range(len(_name) - 2)}:
+        _TRIGRAMS.setdefault(_trigram, set()).add(_i)
+del _i, _name, _trigram
+_TRIGRAMS = {trigram: frozenset(indexes) for trigram, indexes in _TRIGRAMS.items()}
+
+# All lowercase names joined by NUL, so queries too short for trigrams are found with
+# one C-level str.find; _NAME_OFFSETS[i] is where _LOWER_NAMES[i] starts in the blob
+_ALL_NAMES_BLOB = "\0".join(_LOWER_NAMES)
+_NAME_OFFSETS = array('i')
+_offset = 0
+for _name in _LOWER_NAMES:
+    _NAME_OFFSETS.append(_offset)
+    _offset += len(_name) + 1
+del _offset, _name
+
+# Lowercase class name -> rank-annotated servants of that class, in rank order
+_CLASS_INDEX = {}
+for _servant in _ALL_SERVANTS:
+    _CLASS_INDEX.setdefault(sys.intern(_servant['class'].lower()), []).append(_servant)
+del _servant
+_CLASS_INDEX = {servant_class: tuple(servants) for servant_class, servants in _CLASS_INDEX.items()}
+
+# Read-only servant count per rank, and the overall total
+RANK_COUNTS: Final = MappingProxyType({rank: len(SERVANTS[rank]) for rank in _RANK_KEYS})
+TOTAL_SERVANTS: Final[int] = len(_ALL_SERVANTS)
+
+# _ALL_SERVANTS is ordered by rank, so each rank is the slice
+# [_RANK_OFFSETS[i], _RANK_OFFSETS[i + 1]) where i = _RANK_ORDER[rank]
+_RANK_ORDER = {rank: i for i, rank in enumerate(_RANK_KEYS)}
+_RANK_OFFSETS = [0]
+for _rank in _RANK_KEYS:
+    _RANK_OFFSETS.append(_RANK_OFFSETS[-1] + len(SERVANTS[_rank]))
+del _rank
+
+# ============================================================================
+# DISPLAY TABLES
+# ============================================================================
+
+_RANK_COLOR_VALUES = {
+    "EX": 0xFFD700,  # Gold
+    "S": 0xDC143C,   # Crimson
+    "A": 0x9370DB,   # Medium Purple
+    "B": 0x4169E1,   # Royal Blue
+    "C": 0x90EE90,   # Light Green
+}
+
+# Color objects are built on first use so importing servant data doesn't pull in discord
+_RANK_COLORS = None
+_DEFAULT_RANK_COLOR = None
+
+def _init_colors():
+    """Build the shared rank Color objects"""
+    global _RANK_COLORS, _DEFAULT_RANK_COLOR
+    import discord
+    _RANK_COLORS = {rank: discord.Color(value) for rank, value in _RANK_COLOR_VALUES.items()}
+    _DEFAULT_RANK_COLOR = discord.Color.greyple()
+
+_RANK_EMOJIS = {
+    "EX": "⭐",
+    "S": "💎",
+    "A": "🔷",
+    "B": "🔹",
+    "C": "⚪",
+}
+
+_CLASS_EMOJIS = {
+    "Saber": "⚔️",
+    "Archer": "🏹",
+    "Lancer": "🔱",
+    "Rider": "🐎",
+    "Caster": "📖",
+    "Assassin": "🗡️",
+    "Berserker": "💢",
+    "Ruler": "⚖️",
+    "Avenger": "😈",
+    "Alter Ego": "👥",
+    "Foreigner": "🌌",
+    "Shielder": "🛡️",
+}
+
+def get_rank_color(rank: str) -> "discord.Color":
     """Get the color associated with a rank"""
-    colors = {
-        "EX": discord.Color.from_rgb(255, 215, 0),  # Gold
-        "S": discord.Color.from_rgb(220, 20, 60),   # Crimson
-        "A": discord.Color.from_rgb(147, 112, 219), # Medium Purple
-        "B": discord.Color.from_rgb(65, 105, 225),  # Royal Blue
-        "C": discord.Color.from_rgb(144, 238, 144), # Light Green
-    }
-    return colors.get(rank, discord.Color.greyple())
+    if _RANK_COLORS is None:
+        _init_colors()
+    return _RANK_COLORS.get(rank, _DEFAULT_RANK_COLOR)
 
 def get_rank_emoji(rank: str) -> str:
     """Get the emoji associated with a rank"""
-    emojis = {
-        "EX": "⭐",
-        "S": "💎",
-        "A": "🔷",
-        "B": "🔹",
-        "C": "⚪",
-    }
-    return emojis.get(rank, "❓")
+    return _RANK_EMOJIS.get(rank, "❓")
 
 def get_class_emoji(servant_class: str) -> str:
     """Get the emoji associated with a servant class"""
-    class_emojis = {
-        "Saber": "⚔️",
-        "Archer": "🏹",
-        "Lancer": "🔱",
-        "Rider": "🐎",
-        "Caster": "📖",
-        "Assassin": "🗡️",
-        "Berserker": "💢",
-        "Ruler": "⚖️",
-        "Avenger": "😈",
-        "Alter Ego": "👥",
-        "Foreigner": "🌌",
-        "Shielder": "🛡️",
-    }
-    return class_emojis.get(servant_class, "❓")
+    return _CLASS_EMOJIS.get(servant_class, "❓")
+
+def iter_all_servants():
+    """Iterate all servants across all ranks without building a list"""
+    yield from _ALL_SERVANTS
 
 def get_all_servants():
-    """Get all servants across all ranks"""
-    all_servants = []
-    for rank, servants in SERVANTS.items():
-        for servant in servants:
-            servant_copy = servant.copy()
-            servant_copy['rank'] = rank
-            all_servants.append(servant_copy)
-    return all_servants
+    """Get all servants across all ranks (entries are read-only views)"""
+    return list(_ALL_SERVANTS)
 
+@lru_cache(maxsize=256)
 def search_servant(name: str):
-    """Search for a servant by name"""
+    """Search for a servant by name (exact match first, then substring); read-only result"""
     name_lower = name.lower()
-    for rank, servants in SERVANTS.items():
-        for servant in servants:
-            if name_lower in servant['name'].lower():
-                servant_copy = servant.copy()
-                servant_copy['rank'] = rank
-                return servant_copy
+    hit = _NAME_INDEX.get(name_lower)
+    if hit:
+        return hit
+    if len(name_lower) < 3:
+        # Too short to have a trigram; the first hit in the blob is the first name in rank order
+        if "\0" in name_lower:
+            return None
+        pos = _ALL_NAMES_BLOB.find(name_lower)
+        if pos < 0:
+            return None
+        return _SERVANT_REFS[bisect_right(_NAME_OFFSETS, pos) - 1]
+    
+    # Any name containing the query contains every trigram of the query
+    candidates = None
+    for trigram in {name_lower[j:j + 3] for j in range(len(name_lower) - 2)}:
+        matches = _TRIGRAMS.get(trigram)
+        if not matches:
+            return None
+        candidates = matches if candidates is None else candidates & matches
+    for i in sorted(candidates):  # keep first-in-rank-order semantics
+        if name_lower in _LOWER_NAMES[i]:
+            return _SERVANT_REFS[i]
     return None
 
+def search_servants_multi(query: str):
+    """Search for several comma-separated servant names at once, in query order without duplicates"""
+    results = []
+    seen = set()
+    for term in query.split(','):
+        term = term.strip()
+        if not term:
+            continue
+        servant = search_servant(term)
+        if servant is not None and id(servant) not in seen:
+            seen.add(id(servant))
+            results.append(servant)
+    return results
+
+def iter_servants_by_class(servant_class: str):
+    """Iterate servants of a specific class without building a list"""
+    yield from _CLASS_INDEX.get(servant_class.lower(), ())
+
 def get_servants_by_class(servant_class: str):
-    """Get all servants of a specific class"""
-    result = []
-    for rank, servants in SERVANTS.items():
-        for servant in servants:
-            if servant['class'].lower() == servant_class.lower():
-                servant_copy = servant.copy()
-                servant_copy['rank'] = rank
-                result.append(servant_copy)
-    return result
+    """Get all servants of a specific class (entries are read-only views)"""
+    return list(_CLASS_INDEX.get(servant_class.lower(), ()))
+
+def get_servants_up_to_rank(rank: str):
+    """Get all servants from EX down to and including the given rank (entries are read-only views)"""
+    order = _RANK_ORDER.get(rank)
+    if order is None:
+        return []
+    return list(_ALL_SERVANTS[:_RANK_OFFSETS[order + 1]])
 
 def get_rank_stats():
-    """Get statistics about servants per rank"""
-    return {
-        rank: len(servants) 
-        for rank, servants in SERVANTS.items()
-    }
+    """Get statistics about servants per rank (read-only)"""
+    return RANK_COUNTS